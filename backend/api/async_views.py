@@ -0,0 +1,117 @@
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIHandler
+from django.db import close_old_connections, connections
+from rest_framework.permissions import SAFE_METHODS
+
+ASYNC_ROUTES = (
+    'recipe-list',
+    'recipe-detail',
+    'users-subscriptions',
+    'ingredients-list',
+    'recipe-download-shopping-cart',
+)
+
+
+class StreamingASGIHandler(ASGIHandler):
+    """
+    ASGI-обработчик, перебирающий потоковые ответы вне цикла событий.
+
+    Django 3.2 перебирает потоковый ответ прямо в цикле событий, где
+    нельзя обращаться к базе и долго считать (PDF). Здесь каждый
+    следующий фрагмент берется в отдельном потоке этого ответа (курсор
+    базы остается в одном потоке) и сразу отправляется клиенту, так что
+    ответ не собирается в памяти целиком.
+    """
+
+    async def send_response(self, response, send):
+        if not response.streaming:
+            return await super().send_response(response, send)
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        executor = ThreadPoolExecutor(max_workers=1)
+
+        def run(function, *args):
+            return loop.run_in_executor(
+                executor, functools.partial(context.run, function, *args)
+            )
+
+        await send({
+            'type': 'http.response.start',
+            'status': response.status_code,
+            'headers': [
+                *(
+                    (header.encode('ascii'), value.encode('latin1'))
+                    for header, value in response.items()
+                ),
+                *(
+                    (
+                        b'Set-Cookie',
+                        cookie.output(header='').encode('ascii').strip()
+                    )
+                    for cookie in response.cookies.values()
+                ),
+            ],
+        })
+        try:
+            parts = await run(iter, response)
+            while (part := await run(next, parts, None)) is not None:
+                for chunk, _ in self.chunk_bytes(part):
+                    await send({
+                        'type': 'http.response.body',
+                        'body': chunk,
+                        'more_body': True,
+                    })
+            await send({'type': 'http.response.body'})
+        finally:
+            await run(connections.close_all)
+            executor.shutdown(wait=False)
+        await sync_to_async(response.close, thread_sensitive=True)()
+
+
+def run_view(view, request, *args, **kwargs):
+    """
+    Выполнение представления в потоке пула.
+
+    Подключения к базе в потоках пула живут по тем же правилам, что и в
+    обычном запросе: close_old_connections() до и после.
+    """
+    close_old_connections()
+    try:
+        response = view(request, *args, **kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+        return response
+    finally:
+        close_old_connections()
+
+
+def async_view(view):
+    """
+    Асинхронная обертка синхронного представления DRF для ASGI-режима.
+
+    Django 3.2 выполняет синхронные представления под ASGI в одном общем
+    потоке процесса, поэтому запросы выстраиваются в очередь. Безопасные
+    запросы (GET, HEAD, OPTIONS) выполняются в пуле потоков
+    (thread_sensitive=False), и запросы одного воркера обрабатываются
+    параллельно. Асинхронного ORM в Django 3.2 нет, поэтому обращения к
+    базе тоже идут из пула. Изменяющие запросы выполняются, как обычное
+    синхронное представление, в общем потоке. Потоковые ответы
+    передаются клиенту частями (StreamingASGIHandler).
+    """
+
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method not in SAFE_METHODS:
+            return await sync_to_async(view, thread_sensitive=True)(
+                request, *args, **kwargs
+            )
+        return await sync_to_async(run_view, thread_sensitive=False)(
+            view, request, *args, **kwargs
+        )
+
+    return wrapper
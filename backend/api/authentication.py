@@ -0,0 +1,40 @@
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+from recipes.cache import TOKEN_USER_FIELDS, get_token_snapshot
+from users.models import User
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Аутентификация по токену с кэшем token -> снимок пользователя.
+
+    Снимок (get_token_snapshot) содержит только поля TOKEN_USER_FIELDS,
+    остальные поля пользователя загружаются из базы при обращении к ним.
+    Запись сбрасывается при удалении токена (выход), изменении и
+    удалении пользователя. Каждый запрос получает свои объекты.
+    """
+
+    def authenticate_credentials(self, key):
+        snapshot = get_token_snapshot(key)
+        if snapshot is None:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        created, values = snapshot
+        fields = dict(zip(TOKEN_USER_FIELDS, values))
+        names = [
+            field.attname for field in User._meta.concrete_fields
+            if field.attname in fields
+        ]
+        user = User.from_db(
+            'default', names, [fields[name] for name in names]
+        )
+        if not user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.')
+            )
+        token = self.get_model().from_db(
+            'default', ('key', 'user_id', 'created'), (key, user.pk, created)
+        )
+        token.user = user
+        return user, token
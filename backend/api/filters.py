@@ -1,6 +1,15 @@
+from django.db.models import Exists, OuterRef
+from django.utils.functional import cached_property
 from django_filters import rest_framework
+from rest_framework.filters import OrderingFilter
 
-from recipes.models import Ingredient, Recipe, Tag
+from recipes.indexes import tag_index
+from recipes.models import CatalogueVersion, Ingredient, Recipe
+from recipes.services import get_catalogue_versions
+
+
+def get_tag_choices():
+    return tag_index.choices()
 
 
 class IngredientSearchFilter(rest_framework.FilterSet):
@@ -16,17 +25,23 @@ class IngredientSearchFilter(rest_framework.FilterSet):
 class RecipeSearchFilter(rest_framework.FilterSet):
     """Фильтр для рецептов."""
 
-    is_favorited = rest_framework.BooleanFilter()
-    is_in_shopping_cart = rest_framework.BooleanFilter()
+    is_favorited = rest_framework.BooleanFilter(
+        field_name='favorite_recipes',
+        method='filter_user_recipes'
+    )
+    is_in_shopping_cart = rest_framework.BooleanFilter(
+        field_name='cart_recipes',
+        method='filter_user_recipes'
+    )
     author = rest_framework.NumberFilter(
         field_name='author__id'
     )
-    tags = rest_framework.ModelMultipleChoiceFilter(
-        field_name='tags__slug',
-        to_field_name='slug',
+    tags = rest_framework.MultipleChoiceFilter(
         label='tags',
-        queryset=Tag.objects.all()
+        choices=get_tag_choices,
+        method='filter_tags'
     )
+    search = rest_framework.CharFilter(method='filter_search')
 
     class Meta:
         model = Recipe
@@ -34,5 +49,74 @@ class RecipeSearchFilter(rest_framework.FilterSet):
             'is_favorited',
             'is_in_shopping_cart',
             'author',
-            'tags'
+            'tags',
+            'search'
         )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.filters['tags'].extra['choices'] = self.get_tag_choices
+
+    @cached_property
+    def tag_version(self):
+        """Версия справочника тегов, одна на запрос."""
+        version, _ = get_catalogue_versions().get(
+            CatalogueVersion.TAG, (0, None)
+        )
+        return version
+
+    def get_tag_choices(self):
+        return tag_index.choices(self.tag_version)
+
+    def filter_user_recipes(self, queryset, name, value):
+        """
+        Рецепты из избранного или корзины пользователя.
+
+        Отбор идет соединением со строками Favorite/Cart пользователя
+        (индекс user, recipe), а не проверкой EXISTS для каждого рецепта.
+        У анонимного пользователя избранного и корзины нет.
+        """
+        user = self.request.user
+        if not user.is_authenticated:
+            return queryset.none() if value else queryset
+        if value:
+            return queryset.filter(**{f'{name}__user': user})
+        return queryset.exclude(**{f'{name}__user': user})
+
+    def filter_tags(self, queryset, name, value):
+        """
+        Рецепты хотя бы с одним из тегов. Slug переводятся в id по
+        индексу в памяти (той же версии справочника, что и при проверке
+        значений), отбор - подзапросом EXISTS, поэтому рецепт с
+        несколькими подходящими тегами не дублируется.
+        """
+        if not value:
+            return queryset
+        return queryset.filter(Exists(
+            Recipe.tags.through.objects.filter(
+                recipe=OuterRef('pk'),
+                tag_id__in=tag_index.get_ids(value, self.tag_version)
+            )
+        ))
+
+    def filter_search(self, queryset, name, value):
+        """Полнотекстовый поиск, результаты по убыванию релевантности."""
+        return queryset.search(value)
+
+
+class StableOrderingFilter(OrderingFilter):
+    """
+    Сортировка по параметру ordering.
+
+    Если сортировка не включает id, к ней добавляется сортировка модели
+    по умолчанию, чтобы записи с равными значениями не перемешивались
+    между страницами.
+    """
+
+    def get_ordering(self, request, queryset, view):
+        ordering = super().get_ordering(request, queryset, view)
+        if ordering and not any(
+            field.lstrip('-') in ('id', 'pk') for field in ordering
+        ):
+            ordering = (*ordering, *queryset.model._meta.ordering)
+        return ordering
@@ -0,0 +1,276 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextvars import ContextVar
+
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from foodgram.db.pooling import stats as connection_stats
+from recipes.cache import registry as cache_registry
+
+SECONDS_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+QUERIES_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100)
+SIZE_BUCKETS = (
+    256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304
+)
+
+current_request = ContextVar('current_request', default=None)
+
+
+class Histogram:
+    """Гистограмма в формате Prometheus с набором меток."""
+
+    def __init__(self, name, description, buckets):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.series = defaultdict(
+            lambda: [[0] * (len(buckets) + 1), 0, 0]
+        )
+
+    def observe(self, labels, value):
+        counts, *_ = series = self.series[labels]
+        counts[bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        yield f'# HELP {self.name} {self.description}'
+        yield f'# TYPE {self.name} histogram'
+        for labels, (counts, total, count) in sorted(self.series.items()):
+            cumulative = 0
+            for bound, number in zip(self.buckets + ('+Inf',), counts):
+                cumulative += number
+                yield (
+                    f'{self.name}_bucket'
+                    f'{format_labels(labels + (("le", bound),))} {cumulative}'
+                )
+            yield f'{self.name}_sum{format_labels(labels)} {total}'
+            yield f'{self.name}_count{format_labels(labels)} {count}'
+
+
+def format_labels(labels):
+    return '{%s}' % ','.join(
+        '{}="{}"'.format(
+            name,
+            str(value).replace('\\', '\\\\').replace('"', '\\"')
+        )
+        for name, value in labels
+    )
+
+
+class Metrics:
+    """
+    Метрики запросов текущего процесса.
+
+    Под gunicorn у каждого воркера свои значения: Prometheus видит
+    воркер, обработавший запрос к /api/metrics/.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = defaultdict(int)
+        self.histograms = {
+            'duration': Histogram(
+                'foodgram_request_duration_seconds',
+                'Время обработки запроса.', SECONDS_BUCKETS
+            ),
+            'queries': Histogram(
+                'foodgram_request_queries',
+                'Число SQL-запросов за запрос.', QUERIES_BUCKETS
+            ),
+            'sql': Histogram(
+                'foodgram_request_sql_seconds',
+                'Время выполнения SQL за запрос.', SECONDS_BUCKETS
+            ),
+            'serializer': Histogram(
+                'foodgram_request_serializer_seconds',
+                'Время сериализации за запрос.', SECONDS_BUCKETS
+            ),
+            'size': Histogram(
+                'foodgram_response_size_bytes',
+                'Размер ответа.', SIZE_BUCKETS
+            ),
+        }
+
+    def record(self, request_metrics, status_code):
+        labels = (
+            ('view', request_metrics.view),
+            ('method', request_metrics.method),
+        )
+        values = {
+            'duration': request_metrics.duration,
+            'queries': request_metrics.query_count,
+            'sql': request_metrics.sql_time,
+            'serializer': request_metrics.serializer_time,
+            'size': request_metrics.size,
+        }
+        with self._lock:
+            self.requests[labels + (('status', status_code),)] += 1
+            for name, value in values.items():
+                if value is not None:
+                    self.histograms[name].observe(labels, value)
+
+    def render(self):
+        """
+        Метрики, счетчики кэшей и подключений к базе в текстовом формате
+        Prometheus.
+        """
+        with self._lock:
+            lines = [
+                '# HELP foodgram_requests_total Число запросов.',
+                '# TYPE foodgram_requests_total counter',
+            ]
+            lines.extend(
+                f'foodgram_requests_total{format_labels(labels)} {count}'
+                for labels, count in sorted(self.requests.items())
+            )
+            for histogram in self.histograms.values():
+                lines.extend(histogram.render())
+        lines += [
+            '# HELP foodgram_cache_requests_total Обращения к кэшам.',
+            '# TYPE foodgram_cache_requests_total counter',
+        ]
+        for name, cache in sorted(cache_registry.items()):
+            stats = cache.stats()
+            lines.extend(
+                'foodgram_cache_requests_total{} {}'.format(
+                    format_labels((('cache', name), ('result', result))),
+                    stats[result]
+                )
+                for result in ('local_hits', 'shared_hits', 'misses')
+            )
+        connections_stats = connection_stats.snapshot()
+        lines += [
+            '# HELP foodgram_db_connections_total События подключений к базе.',
+            '# TYPE foodgram_db_connections_total counter',
+        ]
+        lines.extend(
+            'foodgram_db_connections_total{} {}'.format(
+                format_labels((('alias', alias), ('event', event))),
+                values[event]
+            )
+            for alias, values in connections_stats.items()
+            for event in connection_stats.events
+        )
+        lines += [
+            '# HELP foodgram_db_connections_open Открытые подключения.',
+            '# TYPE foodgram_db_connections_open gauge',
+        ]
+        lines.extend(
+            'foodgram_db_connections_open{} {}'.format(
+                format_labels((('alias', alias),)), values['open']
+            )
+            for alias, values in connections_stats.items()
+        )
+        lines += [
+            '# HELP foodgram_db_connect_seconds_total Время установки '
+            'подключений.',
+            '# TYPE foodgram_db_connect_seconds_total counter',
+        ]
+        lines.extend(
+            'foodgram_db_connect_seconds_total{} {}'.format(
+                format_labels((('alias', alias),)), values['connect_seconds']
+            )
+            for alias, values in connections_stats.items()
+        )
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+class RequestMetrics:
+    """
+    Замеры одного запроса: SQL-запросы, время сериализации и размер
+    ответа.
+
+    Текущий запрос хранится в contextvar, поэтому учитываются и запросы
+    к базе из пула потоков (sync_to_async копирует контекст). SQL с
+    длительностью сохраняется только при capture_sql (для журнала
+    медленных запросов).
+    """
+
+    def __init__(self, request, capture_sql=False):
+        self.method = request.method
+        self.view = 'unmatched'
+        self.capture_sql = capture_sql
+        self.queries = []
+        self.query_count = 0
+        self.sql_time = 0
+        self.serializer_time = 0
+        self.serializer_depth = 0
+        self.size = None
+        self.started_at = self.duration = None
+        self.finished = False
+
+    def execute(self, execute, sql, params, many, context):
+        started_at = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started_at
+            self.query_count += 1
+            self.sql_time += duration
+            if self.capture_sql:
+                self.queries.append((duration, sql, params))
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        current_request.set(self)
+
+    def finish(self):
+        if self.finished:
+            return
+        self.finished = True
+        self.duration = time.perf_counter() - self.started_at
+
+
+def get_request_metrics():
+    """Замеры текущего запроса, если он еще не завершен."""
+    request_metrics = current_request.get()
+    if request_metrics is None or request_metrics.finished:
+        return None
+    return request_metrics
+
+
+def execute_with_metrics(execute, sql, params, many, context):
+    request_metrics = get_request_metrics()
+    if request_metrics is None:
+        return execute(sql, params, many, context)
+    return request_metrics.execute(execute, sql, params, many, context)
+
+
+@receiver(connection_created)
+def install_metrics_wrapper(connection, **kwargs):
+    """Учет SQL-запросов каждого нового подключения к базе."""
+    if execute_with_metrics not in connection.execute_wrappers:
+        connection.execute_wrappers.append(execute_with_metrics)
+
+
+class TimedSerializerMixin:
+    """
+    Учет времени сериализации в метриках текущего запроса.
+
+    Засчитывается только внешний вызов to_representation: вложенные
+    сериализаторы входят в него.
+    """
+
+    def to_representation(self, instance):
+        request_metrics = get_request_metrics()
+        if request_metrics is None:
+            return super().to_representation(instance)
+        request_metrics.serializer_depth += 1
+        started_at = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            request_metrics.serializer_depth -= 1
+            if not request_metrics.serializer_depth:
+                request_metrics.serializer_time += (
+                    time.perf_counter() - started_at
+                )
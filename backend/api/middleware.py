@@ -0,0 +1,118 @@
+import asyncio
+import logging
+
+from django.conf import settings
+
+from .metrics import RequestMetrics, metrics
+
+logger = logging.getLogger('foodgram.slow_requests')
+
+
+class StreamingMetrics:
+    """
+    Содержимое потокового ответа с подсчетом размера.
+
+    Замеры запроса завершаются, когда ответ отдан или закрыт: SQL,
+    выполняемый при генерации потока, тоже учитывается.
+    """
+
+    def __init__(self, content, on_close):
+        self.content = content
+        self.on_close = on_close
+        self.size = 0
+
+    def __iter__(self):
+        for chunk in self.content:
+            self.size += len(chunk)
+            yield chunk
+
+    def close(self):
+        if hasattr(self.content, 'close'):
+            self.content.close()
+        self.on_close(self.size)
+
+
+class MetricsMiddleware:
+    """
+    Метрики запросов для /api/metrics/: время ответа, число и время
+    SQL-запросов, время сериализации и размер ответа в разрезе имени
+    маршрута DRF (recipe-list, users-subscriptions ...).
+
+    Если задан METRICS_SLOW_REQUEST_MS, запросы дольше порога пишутся в
+    журнал foodgram.slow_requests вместе с выполненным SQL. Работает и в
+    WSGI, и в ASGI-режиме.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.slow_request_ms = settings.METRICS_SLOW_REQUEST_MS
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        request_metrics = self.start(request)
+        try:
+            response = self.get_response(request)
+        except Exception:
+            request_metrics.finish()
+            raise
+        return self.process_response(request, request_metrics, response)
+
+    async def __acall__(self, request):
+        request_metrics = self.start(request)
+        try:
+            response = await self.get_response(request)
+        except Exception:
+            request_metrics.finish()
+            raise
+        return self.process_response(request, request_metrics, response)
+
+    def start(self, request):
+        request_metrics = RequestMetrics(
+            request, capture_sql=bool(self.slow_request_ms)
+        )
+        request_metrics.start()
+        return request_metrics
+
+    def process_response(self, request, request_metrics, response):
+        if request.resolver_match is not None:
+            request_metrics.view = (
+                request.resolver_match.url_name or 'unnamed'
+            )
+        if not response.streaming:
+            request_metrics.size = len(response.content)
+            self.finish(request, request_metrics, response.status_code)
+            return response
+
+        def on_close(size):
+            request_metrics.size = size
+            self.finish(request, request_metrics, response.status_code)
+
+        response.streaming_content = StreamingMetrics(
+            response.streaming_content, on_close
+        )
+        return response
+
+    def finish(self, request, request_metrics, status_code):
+        request_metrics.finish()
+        metrics.record(request_metrics, status_code)
+        duration_ms = request_metrics.duration * 1000
+        if self.slow_request_ms and duration_ms >= self.slow_request_ms:
+            logger.warning(
+                'Медленный запрос %s %s (%s): %.0f мс, SQL: %s за %.0f мс\n%s',
+                request.method,
+                request.get_full_path(),
+                request_metrics.view,
+                duration_ms,
+                request_metrics.query_count,
+                request_metrics.sql_time * 1000,
+                '\n'.join(
+                    f'{duration * 1000:.1f} мс: {sql} {params!r}'
+                    for duration, sql, params in request_metrics.queries
+                )
+            )
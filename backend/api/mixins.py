@@ -0,0 +1,94 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from rest_framework.response import Response
+
+from recipes.cache import catalogue_cache
+from recipes.services import get_catalogue_versions
+
+
+def make_etag(*parts):
+    """ETag из произвольного набора значений."""
+    return quote_etag(
+        hashlib.sha256(repr(parts).encode()).hexdigest()[:32]
+    )
+
+
+def conditional_response(request, etag, last_modified, get_response):
+    """
+    Ответ 304 Not Modified, если клиент прислал актуальные валидаторы,
+    иначе результат get_response() с заголовками ETag и Last-Modified.
+    """
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(
+        request, etag=etag, last_modified=timestamp
+    )
+    if response is None:
+        response = get_response()
+    if response.status_code in (200, 304):
+        response['ETag'] = etag
+        if timestamp is not None:
+            response['Last-Modified'] = http_date(timestamp)
+    return response
+
+
+class CatalogueConditionalMixin:
+    """
+    Условные и кэшируемые GET-запросы для справочников.
+
+    Валидаторы строятся по версии справочника catalogue, поэтому
+    повторный запрос получает 304 без обращения к сериализатору.
+    Данные ответа хранятся в кэше справочников по ETag и адресу запроса:
+    с новой версией справочника ключ меняется.
+    """
+
+    catalogue = None
+
+    def get_catalogue_version(self):
+        """Версия справочника и дата ее изменения."""
+        return get_catalogue_versions().get(self.catalogue, (0, None))
+
+    def get_validators(self, request, version, updated_at):
+        return (
+            make_etag(
+                self.catalogue, version, request.accepted_renderer.format
+            ),
+            updated_at,
+        )
+
+    def cached_response(self, request, get_response):
+        etag, last_modified = self.get_validators(
+            request, *self.get_catalogue_version()
+        )
+        return conditional_response(
+            request,
+            etag,
+            last_modified,
+            lambda: Response(catalogue_cache.get_or_set(
+                f'{etag}:{request.get_full_path()}',
+                lambda: get_response().data
+            ))
+        )
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(
+            request,
+            lambda: super(CatalogueConditionalMixin, self).list(
+                request, *args, **kwargs
+            )
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            request,
+            lambda: super(CatalogueConditionalMixin, self).retrieve(
+                request, *args, **kwargs
+            )
+        )
+
+
+def vary_on_authorization(response):
+    patch_vary_headers(response, ('Authorization',))
+    return response
@@ -1,8 +1,101 @@
+from django.core.paginator import Paginator
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
+from rest_framework.exceptions import ValidationError
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+KEYSET_ORDERINGS = {
+    ('id',): False,
+    ('pk',): False,
+    ('-id',): True,
+    ('-pk',): True,
+}
+
+
+class CountPaginator(Paginator):
+    """
+    Пагинатор, который считает записи только по id: аннотации списка
+    (признаки избранного, корзины) в COUNT(*) не вычисляются.
+    """
+
+    @cached_property
+    def count(self):
+        if isinstance(self.object_list, QuerySet):
+            return self.object_list.values('pk').order_by().count()
+        return super().count
 
 
 class CustomPagination(PageNumberPagination):
-    """Пагинация для рецептов."""
+    """
+    Пагинация для рецептов.
+
+    По умолчанию постраничная (count/next/previous/results). Параметр
+    cursor включает пагинацию по ключу: следующая страница выбирается
+    условием на id после последней записи, без OFFSET и COUNT(*).
+    Пустой cursor означает первую страницу, значение для следующей
+    приходит в ссылке next.
+    """
 
+    django_paginator_class = CountPaginator
     page_size = 6
     page_size_query_param = 'limit'
+    cursor_query_param = 'cursor'
+    keyset = False
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.cursor_query_param in request.query_params
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view)
+        self.request = request
+        descending = self.get_keyset_direction(queryset)
+        if cursor := request.query_params[self.cursor_query_param]:
+            try:
+                cursor = int(cursor)
+            except ValueError:
+                raise ValidationError(
+                    {self.cursor_query_param: 'Некорректный курсор.'}
+                )
+            queryset = queryset.filter(
+                **{'pk__lt' if descending else 'pk__gt': cursor}
+            )
+        page_size = self.get_page_size(request)
+        page = list(
+            queryset.order_by('-pk' if descending else 'pk')[:page_size + 1]
+        )
+        self.next_cursor = page[page_size - 1].pk if (
+            len(page) > page_size
+        ) else None
+        return page[:page_size]
+
+    def get_keyset_direction(self, queryset):
+        """Направление обхода по id; другие сортировки не поддерживаются."""
+        ordering = tuple(
+            queryset.query.order_by or queryset.model._meta.ordering
+        ) if isinstance(queryset, QuerySet) else None
+        if ordering not in KEYSET_ORDERINGS:
+            raise ValidationError({
+                self.cursor_query_param:
+                    'Пагинация по курсору доступна только при сортировке '
+                    'по умолчанию.'
+            })
+        return KEYSET_ORDERINGS[ordering]
+
+    def get_next_cursor_link(self):
+        if self.next_cursor is None:
+            return None
+        url = remove_query_param(
+            self.request.build_absolute_uri(), self.page_query_param
+        )
+        return replace_query_param(
+            url, self.cursor_query_param, self.next_cursor
+        )
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        return Response({
+            'next': self.get_next_cursor_link(),
+            'results': data,
+        })
@@ -4,18 +4,27 @@ from django.db import transaction
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework.exceptions import ValidationError
 from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS
 
 from users.models import User, Follow
 from recipes.models import (
     Tag, Ingredient, Recipe, RecipeIngredient
 )
+from recipes.cache import get_tag_map
+from recipes.images import image_worker
+from recipes.services import (
+    change_recipe_in_shopping_lists, update_recipe_indexes
+)
+from recipes.storage import file_digest
+
+from .metrics import TimedSerializerMixin
 
 MIN_INGREDIENT_AMOUNT = 1
 MIN_VALUE = 1
 MAX_VALUE = 32000
 
 
-class CustomUserSerializer(UserSerializer):
+class CustomUserSerializer(TimedSerializerMixin, UserSerializer):
     """Селиализатор модели User"""
 
     is_subscribed = serializers.SerializerMethodField()
@@ -32,15 +41,88 @@ class CustomUserSerializer(UserSerializer):
         )
 
     def get_is_subscribed(self, obj):
-        """Проверка подписки."""
+        """
+        Проверка подписки.
+
+        Если признак уже вычислен в запросе (аннотация is_subscribed),
+        повторного обращения к базе не происходит.
+        """
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         user = self.context.get('request').user
+        if user.is_anonymous:
+            return False
         return Follow.objects.filter(
             user=user,
             following=obj.id
-        ).exists() if not user.is_anonymous else False
+        ).exists()
+
 
+class CachedTagField(serializers.PrimaryKeyRelatedField):
+    """Тег по id из кэша справочников; при промахе - запрос к базе."""
 
-class TagSerializer(serializers.ModelSerializer):
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        return CachedTagListField(
+            child_relation=cls(*args, **kwargs),
+            **{
+                key: value for key, value in kwargs.items()
+                if key in MANY_RELATION_KWARGS
+            }
+        )
+
+    def to_internal_value(self, data):
+        return self.get_tag(data, get_tag_map())
+
+    def get_tag(self, data, tags):
+        if not isinstance(data, bool):
+            try:
+                if tag := tags.get(int(data)):
+                    return tag
+            except (TypeError, ValueError):
+                pass
+        return super().to_internal_value(data)
+
+
+class CachedTagListField(serializers.ManyRelatedField):
+    """
+    Список тегов по id: версия справочника и карта тегов получаются один
+    раз на весь список, а не для каждого тега.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        tags = get_tag_map()
+        return [self.child_relation.get_tag(item, tags) for item in data]
+
+
+class ImageRenditionField(serializers.Field):
+    """
+    URL уменьшенной копии изображения рецепта.
+
+    Пока фоновая обработка не завершена, отдается URL оригинала.
+    """
+
+    def __init__(self, rendition, **kwargs):
+        self.rendition = rendition
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        image = getattr(recipe, self.rendition) or recipe.image
+        if not image:
+            return None
+        request = self.context.get('request')
+        if request is None:
+            return image.url
+        return request.build_absolute_uri(image.url)
+
+
+class TagSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Сериализатор для тегов."""
 
     class Meta:
@@ -48,7 +130,7 @@ class TagSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'color', 'slug')
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Сериализатор для ингредиентов."""
 
     class Meta:
@@ -102,7 +184,7 @@ class IngredientAmountSerializer(serializers.ModelSerializer):
         fields = ('id', 'amount')
 
 
-class RecipeGetSerializer(serializers.ModelSerializer):
+class RecipeGetSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Сериализатор рецептов для запроса GET."""
 
     tags = TagSerializer(many=True)
@@ -121,6 +203,8 @@ class RecipeGetSerializer(serializers.ModelSerializer):
         read_only=True,
     )
     image = Base64ImageField()
+    image_thumbnail = ImageRenditionField('image_thumbnail')
+    image_detail = ImageRenditionField('image_detail')
 
     class Meta:
         model = Recipe
@@ -133,15 +217,17 @@ class RecipeGetSerializer(serializers.ModelSerializer):
             'is_in_shopping_cart',
             'name',
             'image',
+            'image_thumbnail',
+            'image_detail',
             'text',
             'cooking_time'
         )
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class RecipeSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Сериализатор рецептов для всех остальных запросов помимо GET."""
 
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = CachedTagField(
         queryset=Tag.objects.all(),
         many=True
     )
@@ -192,7 +278,7 @@ class RecipeSerializer(serializers.ModelSerializer):
                 text=text,
             ).exists():
                 raise ValidationError('Этот рецепт уже был добавлен.')
-        ingredients = self.initial_data.get('ingredients')
+        ingredients = data.get('ingredients')
         if not ingredients:
             raise ValidationError('Нужно выбрать ингредиент')
         ingredients_list = [ingredient['id'] for ingredient in ingredients]
@@ -200,24 +286,83 @@ class RecipeSerializer(serializers.ModelSerializer):
             raise ValidationError(
                 'Ошибка: нельзя выбирать один и тот же ингредиент!'
             )
+        existing = Ingredient.objects.in_bulk(ingredients_list)
+        if missing := [
+            str(pk) for pk in ingredients_list if pk not in existing
+        ]:
+            raise ValidationError({
+                'ingredients': (
+                    f'Ингредиенты не существуют: {", ".join(missing)}.'
+                )
+            })
         return data
 
     def to_representation(self, instance):
-        """Переопределение сериализатора для вывода данных."""
+        """
+        Переопределение сериализатора для вывода данных.
+
+        Рецепт перечитывается со связанными данными, чтобы ответ строился
+        фиксированным числом запросов.
+        """
+        user = self.context['request'].user
         return RecipeGetSerializer(
-            instance, context=self.context
+            Recipe.objects.with_related_data(
+                user
+            ).with_favorited_and_in_cart_status(user).get(pk=instance.pk),
+            context=self.context
         ).data
 
+    @staticmethod
+    def schedule_image_processing(recipe):
+        """Обработка изображения в фоне после фиксации транзакции."""
+        transaction.on_commit(lambda: image_worker.submit(recipe.pk))
+
     @transaction.atomic
-    def create_and_update_objects(self, recipe, ingredients, tags):
+    def create_and_update_objects(self, recipe, ingredients, tags,
+                                  created=False):
+        """
+        Сохранение тегов и ингредиентов рецепта.
+
+        Строки RecipeIngredient сравниваются с новым составом: удаляются,
+        изменяются и создаются только отличающиеся. После этого
+        обновляются поисковый вектор и индекс подбора рецептов.
+        Возвращает прежний состав рецепта {id ингредиента: количество}.
+        """
         recipe.tags.set(tags)
+        amounts = {
+            ingredient['id']: ingredient['amount']
+            for ingredient in ingredients
+        }
+        existing = {} if created else {
+            row.ingredient_id: row
+            for row in recipe.recipe_ingredient.all()
+        }
+        old_amounts = {
+            ingredient_id: row.amount
+            for ingredient_id, row in existing.items()
+        }
+        if removed := existing.keys() - amounts.keys():
+            RecipeIngredient.objects.filter(
+                recipe=recipe,
+                ingredient_id__in=removed
+            ).delete()
+        changed = []
+        for ingredient_id, row in existing.items():
+            if amounts.get(ingredient_id, row.amount) != row.amount:
+                row.amount = amounts[ingredient_id]
+                changed.append(row)
+        RecipeIngredient.objects.bulk_update(changed, ('amount',))
         RecipeIngredient.objects.bulk_create(
-            [RecipeIngredient(
+            RecipeIngredient(
                 recipe=recipe,
-                ingredient=Ingredient.objects.get(pk=ingredient['id']),
-                amount=ingredient['amount']
-            ) for ingredient in ingredients]
+                ingredient_id=ingredient_id,
+                amount=amount
+            )
+            for ingredient_id, amount in amounts.items()
+            if ingredient_id not in existing
         )
+        update_recipe_indexes(recipe.pk, list(amounts))
+        return old_amounts
 
     @transaction.atomic
     def create(self, validated_data):
@@ -225,31 +370,56 @@ class RecipeSerializer(serializers.ModelSerializer):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
         recipe = Recipe.objects.create(**validated_data)
+        self.schedule_image_processing(recipe)
         self.create_and_update_objects(
             recipe=recipe,
             ingredients=ingredients,
-            tags=tags
+            tags=tags,
+            created=True
         )
         return recipe
 
     @transaction.atomic
     def update(self, recipe, validated_data):
-        """Редактирование рецепта."""
-        recipe.ingredients.clear()
+        """
+        Редактирование рецепта.
+
+        Картинка, совпадающая с последней загруженной, не сохраняется
+        и не обрабатывается повторно.
+        """
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
+        image = validated_data.get('image')
+        if image is not None and file_digest(image) == recipe.image_hash:
+            del validated_data['image']
+        if 'image' in validated_data:
+            validated_data['image_thumbnail'] = ''
+            validated_data['image_detail'] = ''
         recipe = super().update(recipe, validated_data)
-        self.create_and_update_objects(
+        if 'image' in validated_data:
+            self.schedule_image_processing(recipe)
+        old_amounts = self.create_and_update_objects(
             recipe=recipe,
             ingredients=ingredients,
             tags=tags
         )
+        change_recipe_in_shopping_lists(
+            recipe,
+            old_amounts,
+            {
+                ingredient['id']: ingredient['amount']
+                for ingredient in ingredients
+            }
+        )
         return recipe
 
 
-class RecipesShortSerializer(serializers.ModelSerializer):
+class RecipesShortSerializer(
+    TimedSerializerMixin, serializers.ModelSerializer
+):
     """Сериализатор рецептов в подписках и корзине."""
     image = Base64ImageField()
+    image_thumbnail = ImageRenditionField('image_thumbnail')
 
     class Meta:
         model = Recipe
@@ -257,6 +427,7 @@ class RecipesShortSerializer(serializers.ModelSerializer):
             'id',
             'name',
             'image',
+            'image_thumbnail',
             'cooking_time'
         )
 
@@ -280,18 +451,51 @@ class SubscriptionsSerializer(CustomUserSerializer):
             'recipes_count'
         )
 
-    def get_recipes_count(self, obj):
-        """Расчет количества рецептов пользователя."""
-        return obj.recipes.count()
-
     def get_recipes(self, obj):
-        """Ограничение количества рецептов в подписках."""
-        queryset = Recipe.objects.filter(author=obj)
-        if recipes_limit := self.context['request'].GET.get(
-                'recipes_limit'
-        ):
-            queryset = queryset[:int(recipes_limit)]
+        """
+        Ограничение количества рецептов в подписках.
+
+        Для страницы подписок рецепты всех авторов загружаются заранее
+        одним запросом и передаются в контексте (recipes_by_author).
+        """
+        recipes_by_author = self.context.get('recipes_by_author')
+        if recipes_by_author is None:
+            recipes_by_author = Recipe.objects.latest_by_author(
+                (obj,), self.context.get('recipes_limit')
+            )
         return RecipesShortSerializer(
-            queryset,
+            recipes_by_author.get(obj.id, ()),
             many=True
         ).data
+
+
+class RecipesLimitSerializer(serializers.Serializer):
+    """Проверка параметра recipes_limit."""
+
+    recipes_limit = serializers.IntegerField(
+        min_value=0,
+        required=False,
+    )
+
+
+class PantrySerializer(serializers.Serializer):
+    """Проверка списка имеющихся ингредиентов."""
+
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=100,
+    )
+
+
+class PantryRecipeSerializer(RecipesShortSerializer):
+    """Рецепт, подобранный по имеющимся ингредиентам."""
+
+    coverage = serializers.FloatField(read_only=True)
+    missing_ingredients = IngredientSerializer(many=True, read_only=True)
+
+    class Meta(RecipesShortSerializer.Meta):
+        fields = RecipesShortSerializer.Meta.fields + (
+            'coverage',
+            'missing_ingredients'
+        )
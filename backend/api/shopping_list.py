@@ -0,0 +1,151 @@
+import csv
+import os
+from functools import lru_cache
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import simpleSplit
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+FONT_NAME = 'FreeSans'
+FONT_PATH = os.path.join(settings.BASE_DIR, 'static', 'fonts', 'FreeSans.ttf')
+FILENAME = 'shopping_list'
+TITLE = 'Список покупок:'
+CHUNK_SIZE = 64 * 1024
+SPOOL_MAX_SIZE = 1024 * 1024
+
+
+@lru_cache(maxsize=None)
+def register_font():
+    """Регистрирует шрифт один раз за время жизни процесса."""
+    pdfmetrics.registerFont(TTFont(FONT_NAME, FONT_PATH))
+    return FONT_NAME
+
+
+def format_item(name, measurement_unit, amount):
+    return f'{name} ({measurement_unit}) — {amount}'
+
+
+class ShoppingListExport:
+    """
+    Базовый класс выгрузки списка покупок.
+
+    Получает итерируемый набор кортежей (название, единица, количество)
+    и отдает документ потоком через StreamingHttpResponse.
+    """
+
+    content_type = None
+    extension = None
+
+    def __init__(self, items):
+        self.items = items
+
+    def stream(self):
+        raise NotImplementedError
+
+    def response(self):
+        response = StreamingHttpResponse(
+            self.stream(),
+            content_type=self.content_type
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="{FILENAME}.{self.extension}"'
+        )
+        return response
+
+
+class TxtExport(ShoppingListExport):
+    """Список покупок в виде текста, по строке на ингредиент."""
+
+    content_type = 'text/plain; charset=utf-8'
+    extension = 'txt'
+
+    def stream(self):
+        yield f'{TITLE}\n'.encode()
+        for item in self.items:
+            yield f'{format_item(*item)}\n'.encode()
+
+
+class Echo:
+    """Псевдобуфер для csv.writer: возвращает строку вместо записи."""
+
+    def write(self, value):
+        return value
+
+
+class CsvExport(ShoppingListExport):
+    """Список покупок в формате CSV."""
+
+    content_type = 'text/csv; charset=utf-8'
+    extension = 'csv'
+
+    def stream(self):
+        writer = csv.writer(Echo())
+        # BOM нужен, чтобы Excel распознал кодировку.
+        yield '\ufeff'.encode()
+        yield writer.writerow(
+            ('Ингредиент', 'Единица измерения', 'Количество')
+        ).encode()
+        for item in self.items:
+            yield writer.writerow(item).encode()
+
+
+class PdfExport(ShoppingListExport):
+    """
+    Список покупок в PDF с переносом строк и разбивкой на страницы.
+
+    ReportLab формирует документ целиком, поэтому он пишется во временный
+    файл (в памяти до SPOOL_MAX_SIZE, дальше на диске) и отдается частями.
+    """
+
+    content_type = 'application/pdf'
+    extension = 'pdf'
+    font_size = 12
+    leading = 16
+    margin = 60
+
+    def draw(self, pdf_canvas):
+        font = register_font()
+        width, height = A4
+        max_width = width - 2 * self.margin
+
+        def new_page():
+            text_object = pdf_canvas.beginText(
+                self.margin, height - self.margin
+            )
+            text_object.setFont(font, self.font_size)
+            text_object.setLeading(self.leading)
+            return text_object
+
+        text_object = new_page()
+        text_object.textLine(TITLE)
+        for item in self.items:
+            for line in simpleSplit(
+                format_item(*item), font, self.font_size, max_width
+            ):
+                if text_object.getY() < self.margin:
+                    pdf_canvas.drawText(text_object)
+                    pdf_canvas.showPage()
+                    text_object = new_page()
+                text_object.textLine(line)
+        pdf_canvas.drawText(text_object)
+
+    def stream(self):
+        with SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as buffer:
+            pdf_canvas = canvas.Canvas(buffer, pagesize=A4)
+            pdf_canvas.setTitle('Ваш список покупок')
+            self.draw(pdf_canvas)
+            pdf_canvas.save()
+            buffer.seek(0)
+            while chunk := buffer.read(CHUNK_SIZE):
+                yield chunk
+
+
+EXPORT_FORMATS = {
+    export.extension: export
+    for export in (PdfExport, TxtExport, CsvExport)
+}
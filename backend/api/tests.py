@@ -0,0 +1,438 @@
+from django.core.cache import caches
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from recipes.cache import recipe_cache, registry as cache_registry, token_cache
+from recipes.indexes import ingredient_index, pantry_index, tag_index
+from recipes.models import (
+    Cart, CatalogueVersion, Favorite, Ingredient, Recipe, ShoppingListItem,
+    Tag
+)
+from recipes.services import bump_catalogue_version, delete_recipe
+from users.models import Follow, User
+
+PAGE_SIZES = (1, 10)
+TAG_COUNT = 3
+INGREDIENT_COUNT = 5
+
+LOCAL_CACHES = override_settings(CACHES={
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+})
+
+
+def create_user(username):
+    return User.objects.create_user(
+        email=f'{username}@example.com', username=username,
+        first_name='Имя', last_name='Фамилия', password='password'
+    )
+
+
+def create_recipe(author, name, amounts, tags=()):
+    """Рецепт с ингредиентами amounts {ингредиент: количество}."""
+    recipe = Recipe.objects.create(
+        author=author,
+        name=name,
+        text='Описание',
+        cooking_time=10,
+        image='recipes/images/test.jpg',
+    )
+    recipe.tags.set(tags)
+    for ingredient, amount in amounts.items():
+        recipe.ingredients.add(
+            ingredient, through_defaults={'amount': amount}
+        )
+    return recipe
+
+
+@LOCAL_CACHES
+class RecipeQueryCountTests(TestCase):
+    """
+    Число SQL-запросов списка и карточки рецепта не зависит от размера
+    страницы и состава рецепта.
+
+    Перед каждым замером кэши и индексы в памяти сбрасываются, поэтому
+    сравниваются запросы с одинаково холодным кэшем.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.reader = create_user('reader')
+        tags = [
+            Tag.objects.create(
+                name=f'Тег {number}', slug=f'tag-{number}',
+                color=f'#00000{number}'
+            )
+            for number in range(TAG_COUNT)
+        ]
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {number}', measurement_unit='г'
+            )
+            for number in range(INGREDIENT_COUNT)
+        ]
+        cls.recipes = [
+            create_recipe(
+                cls.author,
+                f'Рецепт {number}',
+                dict.fromkeys(
+                    ingredients[:number % INGREDIENT_COUNT + 1], 100
+                ),
+                tags[:number % TAG_COUNT + 1]
+            )
+            for number in range(max(PAGE_SIZES))
+        ]
+        Follow.objects.create(user=cls.reader, following=cls.author)
+        for recipe in cls.recipes[::2]:
+            Favorite.objects.create(user=cls.reader, recipe=recipe)
+            Cart.objects.create(user=cls.reader, recipe=recipe)
+
+    def setUp(self):
+        self.anonymous = APIClient()
+        self.authenticated = APIClient()
+        self.authenticated.force_authenticate(self.reader)
+
+    def count_queries(self, client, url, method='get', **kwargs):
+        caches['default'].clear()
+        for cache in cache_registry.values():
+            cache.invalidate()
+        for index in (ingredient_index, tag_index, pantry_index):
+            index.invalidate()
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(client, method)(url, **kwargs)
+        self.assertEqual(response.status_code, 200, response.content)
+        return len(queries)
+
+    def assert_list_queries_constant(self, params=''):
+        for name, client in (
+            ('anonymous', self.anonymous),
+            ('authenticated', self.authenticated),
+        ):
+            with self.subTest(user=name, params=params):
+                counts = [
+                    self.count_queries(
+                        client, f'/api/recipes/?limit={limit}{params}'
+                    )
+                    for limit in PAGE_SIZES
+                ]
+                self.assertEqual(len(set(counts)), 1, counts)
+
+    def test_shared_page_list(self):
+        self.assert_list_queries_constant()
+
+    def test_user_specific_list(self):
+        self.assert_list_queries_constant('&is_favorited=0')
+        self.assert_list_queries_constant('&ordering=-favorites_count')
+
+    def test_detail(self):
+        for name, client in (
+            ('anonymous', self.anonymous),
+            ('authenticated', self.authenticated),
+        ):
+            with self.subTest(user=name):
+                counts = [
+                    self.count_queries(client, f'/api/recipes/{recipe.pk}/')
+                    for recipe in self.recipes[:INGREDIENT_COUNT]
+                ]
+                self.assertEqual(len(set(counts)), 1, counts)
+
+    def test_update_tags(self):
+        """Теги рецепта разрешаются по id одним обращением к справочнику."""
+        client = APIClient()
+        client.force_authenticate(self.author)
+        counts = []
+        for recipe in self.recipes[:TAG_COUNT]:
+            ingredients = recipe.recipe_ingredient.all()
+            counts.append(self.count_queries(
+                client,
+                f'/api/recipes/{recipe.pk}/',
+                'patch',
+                data={
+                    'tags': [tag.pk for tag in recipe.tags.all()],
+                    'ingredients': [
+                        {'id': row.ingredient_id, 'amount': row.amount}
+                        for row in ingredients
+                    ],
+                },
+                format='json'
+            ))
+        self.assertEqual(len(set(counts)), 1, counts)
+
+
+@LOCAL_CACHES
+class ShoppingListTests(TestCase):
+    """
+    Список покупок следует за корзиной: добавлением и удалением рецептов,
+    изменением их состава и каскадным удалением.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.reader = create_user('reader')
+        cls.flour, cls.milk, cls.sugar = (
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('мука', 'молоко', 'сахар')
+        )
+        cls.tag = Tag.objects.create(
+            name='Завтрак', slug='breakfast', color='#000000'
+        )
+        cls.pancakes = create_recipe(
+            cls.author, 'Блины', {cls.flour: 200, cls.milk: 500}, [cls.tag]
+        )
+        cls.pie = create_recipe(
+            cls.author, 'Пирог', {cls.flour: 300, cls.sugar: 100}, [cls.tag]
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+    def get_shopping_list(self, user):
+        return dict(ShoppingListItem.objects.filter(user=user).values_list(
+            'ingredient', 'amount'
+        ))
+
+    def add_to_cart(self, recipe, user=None):
+        if user is None:
+            response = self.client.post(
+                f'/api/recipes/{recipe.pk}/shopping_cart/'
+            )
+            self.assertEqual(response.status_code, 201, response.content)
+        else:
+            Cart.objects.create(user=user, recipe=recipe)
+
+    def test_cart_add_and_remove(self):
+        self.add_to_cart(self.pancakes)
+        self.assertEqual(
+            self.get_shopping_list(self.reader),
+            {self.flour.pk: 200, self.milk.pk: 500}
+        )
+        self.add_to_cart(self.pie)
+        self.assertEqual(
+            self.get_shopping_list(self.reader),
+            {self.flour.pk: 500, self.milk.pk: 500, self.sugar.pk: 100}
+        )
+        response = self.client.delete(
+            f'/api/recipes/{self.pancakes.pk}/shopping_cart/'
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(
+            self.get_shopping_list(self.reader),
+            {self.flour.pk: 300, self.sugar.pk: 100}
+        )
+        self.client.delete(f'/api/recipes/{self.pie.pk}/shopping_cart/')
+        self.assertEqual(self.get_shopping_list(self.reader), {})
+
+    def test_recipe_ingredients_changed(self):
+        other = create_user('other')
+        self.add_to_cart(self.pancakes)
+        self.add_to_cart(self.pie)
+        self.add_to_cart(self.pancakes, user=other)
+        author = APIClient()
+        author.force_authenticate(self.author)
+        response = author.patch(
+            f'/api/recipes/{self.pancakes.pk}/',
+            {
+                'tags': [self.tag.pk],
+                'ingredients': [
+                    {'id': self.flour.pk, 'amount': 250},
+                    {'id': self.sugar.pk, 'amount': 50},
+                ],
+            },
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(
+            self.get_shopping_list(self.reader),
+            {self.flour.pk: 550, self.sugar.pk: 150}
+        )
+        self.assertEqual(
+            self.get_shopping_list(other),
+            {self.flour.pk: 250, self.sugar.pk: 50}
+        )
+
+    def test_recipe_deleted(self):
+        self.add_to_cart(self.pancakes)
+        self.add_to_cart(self.pie)
+        author = APIClient()
+        author.force_authenticate(self.author)
+        response = author.delete(f'/api/recipes/{self.pancakes.pk}/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(
+            self.get_shopping_list(self.reader),
+            {self.flour.pk: 300, self.sugar.pk: 100}
+        )
+
+    def test_author_deleted(self):
+        other = create_user('other')
+        self.add_to_cart(self.pancakes)
+        self.add_to_cart(self.pie)
+        recipe = create_recipe(other, 'Оладьи', {self.flour: 150})
+        self.add_to_cart(recipe)
+        self.author.delete()
+        self.assertEqual(
+            self.get_shopping_list(self.reader), {self.flour.pk: 150}
+        )
+
+
+@LOCAL_CACHES
+class CounterTests(TestCase):
+    """Денормализованные счетчики ведутся сигналами при любой записи."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = create_user('author')
+        cls.ingredient = Ingredient.objects.create(
+            name='мука', measurement_unit='г'
+        )
+
+    def assert_recipes_count(self, user, expected):
+        user.refresh_from_db(fields=('recipes_count',))
+        self.assertEqual(user.recipes_count, expected)
+
+    def test_recipes_count(self):
+        other = create_user('other')
+        recipe = create_recipe(self.author, 'Блины', {self.ingredient: 1})
+        self.assert_recipes_count(self.author, 1)
+        recipe.author = other
+        recipe.save()
+        self.assert_recipes_count(self.author, 0)
+        self.assert_recipes_count(other, 1)
+        recipe.name = 'Оладьи'
+        recipe.save()
+        self.assert_recipes_count(other, 1)
+        delete_recipe(recipe)
+        self.assert_recipes_count(other, 0)
+
+    def test_favorites_and_cart_count(self):
+        recipe = create_recipe(self.author, 'Блины', {self.ingredient: 1})
+        Favorite.objects.create(user=self.author, recipe=recipe)
+        Cart.objects.create(user=self.author, recipe=recipe)
+        recipe.refresh_from_db()
+        self.assertEqual((recipe.favorites_count, recipe.cart_count), (1, 1))
+        Cart.objects.filter(recipe=recipe).delete()
+        recipe.refresh_from_db()
+        self.assertEqual((recipe.favorites_count, recipe.cart_count), (1, 0))
+
+    def test_delete_recipe_queries(self):
+        """Число запросов удаления рецепта не зависит от числа корзин."""
+        counts = []
+        for readers in (1, 10):
+            recipe = create_recipe(
+                self.author, f'Рецепт {readers}', {self.ingredient: 1}
+            )
+            for number in range(readers):
+                user = create_user(f'reader-{readers}-{number}')
+                Favorite.objects.create(user=user, recipe=recipe)
+                Cart.objects.create(user=user, recipe=recipe)
+            with CaptureQueriesContext(connection) as queries:
+                delete_recipe(recipe)
+            counts.append(len(queries))
+        self.assertEqual(len(set(counts)), 1, counts)
+
+
+@LOCAL_CACHES
+class TagFilterTests(TestCase):
+    """Фильтр по тегам видит изменения тегов, сделанные в других процессах."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = create_user('author')
+        cls.breakfast = Tag.objects.create(
+            name='Завтрак', slug='breakfast', color='#000000'
+        )
+        cls.recipe = create_recipe(author, 'Блины', {}, [cls.breakfast])
+
+    def get_ids(self, slug):
+        response = APIClient().get(f'/api/recipes/?tags={slug}')
+        self.assertEqual(response.status_code, 200, response.content)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_tag_changed_in_other_process(self):
+        self.assertEqual(self.get_ids('breakfast'), [self.recipe.pk])
+        Tag.objects.bulk_create([
+            Tag(name='Ужин', slug='dinner', color='#000001')
+        ])
+        self.recipe.tags.add(Tag.objects.get(slug='dinner'))
+        Tag.objects.filter(pk=self.breakfast.pk).update(slug='brunch')
+        bump_catalogue_version(CatalogueVersion.TAG)
+        recipe_cache.invalidate()
+        self.assertEqual(self.get_ids('dinner'), [self.recipe.pk])
+        self.assertEqual(self.get_ids('brunch'), [self.recipe.pk])
+        response = APIClient().get('/api/recipes/?tags=breakfast')
+        self.assertEqual(response.status_code, 400)
+
+
+@LOCAL_CACHES
+class SearchTests(TestCase):
+    """Поиск рецептов: регистр не учитывается, сортировка по релевантности."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = create_user('author')
+        honey = Ingredient.objects.create(name='мед', measurement_unit='г')
+        flour = Ingredient.objects.create(name='мука', measurement_unit='г')
+        cls.in_name = create_recipe(author, 'Мед с орехами', {flour: 1})
+        cls.in_ingredients = create_recipe(author, 'Пряники', {honey: 1})
+        cls.in_text = create_recipe(author, 'Блины', {flour: 1})
+        Recipe.objects.filter(pk=cls.in_text.pk).update(
+            text='Подавать с медом.'
+        )
+        create_recipe(author, 'Оладьи', {flour: 1})
+        Recipe.objects.update_search_vector()
+
+    def search(self, query):
+        response = APIClient().get('/api/recipes/', {'search': query})
+        self.assertEqual(response.status_code, 200, response.content)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_relevance_order(self):
+        self.assertEqual(
+            self.search('мед'),
+            [self.in_name.pk, self.in_ingredients.pk, self.in_text.pk]
+        )
+
+    def test_case_insensitive(self):
+        for query in ('ПРЯНИКИ', 'пряники', 'Пряники'):
+            with self.subTest(query=query):
+                self.assertEqual(self.search(query), [self.in_ingredients.pk])
+
+    def test_no_matches(self):
+        self.assertEqual(self.search('шоколад'), [])
+
+
+@LOCAL_CACHES
+class TokenCacheTests(TestCase):
+    """Снимок пользователя по токену берется из памяти процесса."""
+
+    def setUp(self):
+        token_cache.invalidate()
+        self.user = create_user('reader')
+        self.client = APIClient()
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {Token.objects.create(user=self.user)}'
+        )
+
+    def test_local_hit_and_logout(self):
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+        hits = token_cache.local_hits
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/users/me/')
+        self.assertEqual(response.data['username'], 'reader')
+        self.assertEqual(token_cache.local_hits, hits + 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+    def test_user_changed(self):
+        self.client.get('/api/users/me/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.first_name = 'Новое'
+            self.user.save()
+        response = self.client.get('/api/users/me/')
+        self.assertEqual(response.data['first_name'], 'Новое')
@@ -1,7 +1,12 @@
-from django.urls import path, include
+from django.conf import settings
+from django.urls import URLPattern, path, include
 from rest_framework import routers
 
+from .async_views import ASYNC_ROUTES, async_view
+
 from .views import (
+    CacheStatsView,
+    MetricsView,
     TagViewSet,
     IngredientViewSet,
     RecipeViewSet,
@@ -32,6 +37,24 @@ v1_router.register(
     basename='users'
 )
 
+
+def get_router_urls():
+    """
+    Маршруты роутера; в ASGI-режиме самые нагруженные представления
+    заменяются асинхронными обертками.
+    """
+    if settings.SERVER_MODE != 'asgi':
+        return v1_router.urls
+    return [
+        URLPattern(
+            url.pattern, async_view(url.callback), url.default_args, url.name
+        ) if url.name in ASYNC_ROUTES else url
+        for url in v1_router.urls
+    ]
+
+
 urlpatterns = [
-    path('', include(v1_router.urls)),
+    path('cache-stats/', CacheStatsView.as_view(), name='cache-stats'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+    path('', include(get_router_urls())),
 ]
@@ -1,32 +1,47 @@
-from django.db.models import Sum, Prefetch
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.db import transaction
+from django.db.models import BooleanField, Exists, OuterRef, Value
 from django.http import HttpResponse
-from django.db.models import Count
 from rest_framework import status, viewsets
 from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from djoser.views import UserViewSet
 from django_filters.rest_framework import DjangoFilterBackend
-from rest_framework.permissions import (AllowAny, IsAuthenticated,
+from rest_framework.permissions import (AllowAny, IsAdminUser,
+                                        IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
-from reportlab.pdfgen import canvas
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
+from rest_framework.views import APIView
 
 from users.models import Follow, User
 from recipes.models import (
     Tag, Ingredient,
     Recipe, Cart,
-    Favorite
+    Favorite, ShoppingListItem, CatalogueVersion
 )
+from recipes.cache import (
+    get_user_flags, recipe_cache, registry as cache_registry
+)
+from recipes.indexes import ingredient_index, pantry_index
+from recipes.services import delete_recipe, get_catalogue_versions
 
-from .filters import IngredientSearchFilter, RecipeSearchFilter
+from .metrics import metrics
+from .filters import (
+    IngredientSearchFilter, RecipeSearchFilter, StableOrderingFilter
+)
+from .mixins import (
+    CatalogueConditionalMixin, conditional_response, make_etag,
+    vary_on_authorization
+)
 from .permissions import IsAuthorOrReadOnly
+from .shopping_list import EXPORT_FORMATS
 from .serializers import (
     TagSerializer, IngredientSerializer,
     RecipeSerializer, RecipesShortSerializer,
     SubscriptionsSerializer, RecipeGetSerializer,
-    CustomUserSerializer
+    CustomUserSerializer, RecipesLimitSerializer,
+    PantrySerializer, PantryRecipeSerializer
 )
 from .pagination import CustomPagination
 
@@ -36,39 +51,55 @@ class CustomUserViewSet(UserViewSet):
     pagination_class = CustomPagination
     queryset = User.objects.all()
     http_method_names = ('get', 'post', 'delete')
+    filter_backends = (StableOrderingFilter,)
+    ordering_fields = ('id', 'recipes_count')
 
     @action(
         detail=False,
         permission_classes=(IsAuthenticated,),
     )
     def me(self, request):
-        """Вывод информации о текущем пользователе."""
-        user = get_object_or_404(
-            User,
-            email=request.user.email
-        )
+        """
+        Вывод информации о текущем пользователе.
+
+        Пользователь уже загружен при аутентификации; подписаться на себя
+        нельзя, поэтому признак подписки не запрашивается.
+        """
+        user = request.user
+        user.is_subscribed = False
         serializer = self.get_serializer(user)
         return Response(serializer.data)
 
+    def get_recipes_limit(self):
+        """Проверенное значение параметра recipes_limit."""
+        serializer = RecipesLimitSerializer(data=self.request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data.get('recipes_limit')
+
     @action(
         methods=('get',),
-        detail=False
+        detail=False,
+        permission_classes=(IsAuthenticated,)
     )
     def subscriptions(self, request):
         """Вывод списка подписок пользователя."""
-        user = request.user
+        recipes_limit = self.get_recipes_limit()
         following = User.objects.filter(
-            following__user=user
-        ).annotate(recipes_count=Count('recipes'))
-        paginate = self.paginate_queryset(following)
+            following__user=request.user
+        ).annotate(
+            is_subscribed=Value(True, output_field=BooleanField())
+        ).order_by('id')
+        paginate = self.paginate_queryset(self.filter_queryset(following))
         serializer = SubscriptionsSerializer(
-            data=paginate,
+            paginate,
             many=True,
             context={
-                'request': request
+                'request': request,
+                'recipes_by_author': Recipe.objects.latest_by_author(
+                    paginate, recipes_limit
+                ),
             }
         )
-        serializer.is_valid()
         return self.get_paginated_response(serializer.data)
 
     @action(
@@ -78,6 +109,7 @@ class CustomUserViewSet(UserViewSet):
     )
     def subscribe(self, request, **kwargs):
         """Создание подписки."""
+        recipes_limit = self.get_recipes_limit()
         user = get_object_or_404(
             User,
             id=kwargs.get('id')
@@ -102,7 +134,8 @@ class CustomUserViewSet(UserViewSet):
         serializer = SubscriptionsSerializer(
             user,
             context={
-                'request': request
+                'request': request,
+                'recipes_limit': recipes_limit,
             }
         )
         return Response(
@@ -129,17 +162,21 @@ class CustomUserViewSet(UserViewSet):
         )
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(CatalogueConditionalMixin, viewsets.ReadOnlyModelViewSet):
     """Вьюсет для тегов."""
 
+    catalogue = CatalogueVersion.TAG
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = (AllowAny,)
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(
+    CatalogueConditionalMixin, viewsets.ReadOnlyModelViewSet
+):
     """Вьюсет для ингредиентов."""
 
+    catalogue = CatalogueVersion.INGREDIENT
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = (AllowAny,)
@@ -148,6 +185,30 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     )
     filterset_class = IngredientSearchFilter
 
+    def list(self, request, *args, **kwargs):
+        """
+        Поиск по названию обслуживается индексом в памяти процесса:
+        сначала совпадения по началу, затем по вхождению, не более
+        INGREDIENT_SEARCH_LIMIT результатов. Индекс перестраивается, если
+        построен не по той версии справочника, по которой выдан ETag.
+        """
+        if name := request.query_params.get('name'):
+            version, updated_at = self.get_catalogue_version()
+            return conditional_response(
+                request,
+                *self.get_validators(request, version, updated_at),
+                lambda: Response(ingredient_index.search(
+                    name, settings.INGREDIENT_SEARCH_LIMIT, version
+                ))
+            )
+        return super().list(request, *args, **kwargs)
+
+
+RECIPE_AUTHOR_FIELDS = (
+    'author__email', 'author__username', 'author__first_name',
+    'author__last_name'
+)
+
 
 class RecipeViewSet(viewsets.ModelViewSet):
     """
@@ -155,25 +216,119 @@ class RecipeViewSet(viewsets.ModelViewSet):
     скачивания списка покупок.
     """
 
-    queryset = (
-        Recipe.objects
-        .select_related('author')
-        .prefetch_related(Prefetch('ingredients'))
-        .all()
-    )
+    queryset = Recipe.objects.select_related('author')
     pagination_class = CustomPagination
     permission_classes = (IsAuthorOrReadOnly, IsAuthenticatedOrReadOnly)
-    filter_backends = (DjangoFilterBackend,)
+    filter_backends = (DjangoFilterBackend, StableOrderingFilter)
     filterset_class = RecipeSearchFilter
+    ordering_fields = ('id', 'favorites_count', 'cart_count')
     http_method_names = ('get', 'post', 'patch', 'delete')
+    user_filters = ('is_favorited', 'is_in_shopping_cart')
+    shared_orderings = ('id', '-id')
+    shared_page = False
 
     def get_queryset(self):
-        queryset = self.queryset
-        if self.request.user.is_authenticated:
-            queryset = queryset.with_favorited_and_in_cart_status(
-                self.request.user
+        user = AnonymousUser() if self.shared_page else self.request.user
+        if self.request.method != 'GET':
+            return self.queryset
+        return Recipe.objects.with_related_data(
+            user
+        ).with_favorited_and_in_cart_status(user)
+
+    def is_shared_page(self, request):
+        """
+        Страница списка одинакова для всех пользователей: нет фильтров по
+        избранному и корзине и сортировки по счетчикам.
+        """
+        params = request.query_params
+        return (
+            not any(name in params for name in self.user_filters)
+            and params.get('ordering', 'id') in self.shared_orderings
+        )
+
+    def list(self, request, *args, **kwargs):
+        """
+        Список рецептов.
+
+        Страница строится без учета пользователя и хранится в кэше
+        рецептов по адресу запроса. Признаки избранного, корзины и
+        подписки на автора накладываются поверх нее из множеств id,
+        закэшированных для пользователя (get_user_flags).
+        """
+        if not self.is_shared_page(request):
+            return super().list(request, *args, **kwargs)
+
+        def get_page():
+            self.shared_page = True
+            try:
+                return super(RecipeViewSet, self).list(
+                    request, *args, **kwargs
+                ).data
+            finally:
+                self.shared_page = False
+
+        data = recipe_cache.get_or_set(
+            request.build_absolute_uri(), get_page
+        )
+        user = request.user
+        if user.is_authenticated:
+            flags = get_user_flags(user)
+            data = dict(data, results=[
+                dict(
+                    recipe,
+                    author=dict(
+                        recipe['author'],
+                        is_subscribed=(
+                            recipe['author']['id'] in flags['following']
+                        )
+                    ),
+                    is_favorited=recipe['id'] in flags['favorites'],
+                    is_in_shopping_cart=recipe['id'] in flags['cart'],
+                )
+                for recipe in data['results']
+            ])
+        return vary_on_authorization(Response(data))
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Рецепт с поддержкой условных запросов.
+
+        ETag учитывает дату изменения рецепта, данные автора, версии
+        справочников и признаки, зависящие от пользователя (избранное,
+        корзина, подписка на автора). Last-Modified отдается только
+        анонимным пользователям: для авторизованных изменение признаков не
+        отражается в дате. Изменение автора обновляет дату его рецептов.
+        """
+        user = request.user
+        recipes = Recipe.objects.filter(pk=kwargs['pk'])
+        fields = ['updated_at', *RECIPE_AUTHOR_FIELDS]
+        if user.is_authenticated:
+            recipes = recipes.with_favorited_and_in_cart_status(
+                user
+            ).annotate(
+                is_subscribed=Exists(Follow.objects.filter(
+                    user=user, following=OuterRef('author')
+                ))
             )
-        return queryset
+            fields += ['is_favorited', 'is_in_shopping_cart', 'is_subscribed']
+        state = get_object_or_404(recipes.values(*fields))
+        versions = get_catalogue_versions()
+        last_modified = max(
+            [state['updated_at']]
+            + [updated_at for _, updated_at in versions.values()]
+        )
+        response = conditional_response(
+            request,
+            make_etag(
+                kwargs['pk'], user.pk, sorted(state.items()),
+                sorted(versions.items()), request.accepted_renderer.format
+            ),
+            None if user.is_authenticated else last_modified,
+            lambda: super(RecipeViewSet, self).retrieve(
+                request, *args, **kwargs
+            )
+        )
+        return vary_on_authorization(response)
 
     def get_serializer_class(self):
         if self.request.method == 'GET':
@@ -185,10 +340,17 @@ class RecipeViewSet(viewsets.ModelViewSet):
             author=self.request.user
         )
 
-    def create_object(
-            self, model, text, serializer
-    ):
-        """Добавление рецепта в избранное или корзину."""
+    def perform_destroy(self, instance):
+        delete_recipe(instance)
+
+    @transaction.atomic
+    def create_object(self, model, text, serializer):
+        """
+        Добавление рецепта в избранное или корзину.
+
+        Счетчики рецепта и список покупок обновляются сигналами
+        сохранения в той же транзакции.
+        """
         if not (recipe := Recipe.objects.filter(
                 id=self.kwargs.get('pk')
         ).first()):
@@ -218,9 +380,8 @@ class RecipeViewSet(viewsets.ModelViewSet):
             status=status.HTTP_201_CREATED
         )
 
-    def delete_object(
-            self, model, text
-    ):
+    @transaction.atomic
+    def delete_object(self, model, text):
         """Удаление рецепта из избранного и корзины."""
         recipe = get_object_or_404(
             Recipe,
@@ -279,41 +440,87 @@ class RecipeViewSet(viewsets.ModelViewSet):
             text=text
         )
 
+    @action(
+        detail=False,
+        methods=('get',)
+    )
+    def pantry(self, request):
+        """
+        Подбор рецептов по имеющимся ингредиентам (?ingredients=1&...).
+
+        Рецепты упорядочены по доле ингредиентов, которые уже есть
+        (coverage), для каждого перечислены недостающие. Подбор идет по
+        индексу в памяти процесса, из базы читается только страница.
+        """
+        serializer = PantrySerializer(
+            data={'ingredients': request.query_params.getlist('ingredients')}
+        )
+        serializer.is_valid(raise_exception=True)
+        page = self.paginate_queryset(
+            pantry_index.search(serializer.validated_data['ingredients'])
+        )
+        recipes = Recipe.objects.defer('search_vector').in_bulk(
+            [recipe_id for recipe_id, *_ in page]
+        )
+        found = []
+        for recipe_id, coverage, missing in page:
+            if recipe := recipes.get(recipe_id):
+                recipe.coverage = coverage
+                recipe.missing_ingredients = [
+                    ingredient for ingredient_id in missing
+                    if (ingredient := ingredient_index.get(ingredient_id))
+                ]
+                found.append(recipe)
+        return self.get_paginated_response(
+            PantryRecipeSerializer(
+                found, many=True, context={'request': request}
+            ).data
+        )
+
     @action(
         detail=False,
         methods=('get',),
         permission_classes=(IsAuthenticated,)
     )
     def download_shopping_cart(self, request):
-        """Скачивание списка покупок в PDF."""
-        recipes = Recipe.objects.filter(
-            cart_recipes__user=request.user
-        )
-        ingredients = Ingredient.objects.filter(
-            recipe_ingredient__recipe__in=recipes
-        )
-        queryset_ingredients = ingredients.annotate(
-            sum_amount_ingredients=(
-                Sum('recipe_ingredient__amount')
+        """
+        Скачивание списка покупок.
+
+        Формат задается параметром file_format: pdf (по умолчанию),
+        txt или csv.
+        """
+        file_format = request.query_params.get('file_format', 'pdf')
+        if file_format not in EXPORT_FORMATS:
+            return Response(
+                f'Доступные форматы: {", ".join(EXPORT_FORMATS)}.',
+                status=status.HTTP_400_BAD_REQUEST
             )
+        items = ShoppingListItem.objects.filter(
+            user=request.user
+        ).order_by('ingredient__name').values_list(
+            'ingredient__name', 'ingredient__measurement_unit', 'amount'
         )
-        response = HttpResponse(content_type='application/pdf')
-        pdfmetrics.registerFont(
-            TTFont(
-                'FreeSans',
-                'static/fonts/FreeSans.ttf'
-            )
+        return EXPORT_FORMATS[file_format](items.iterator()).response()
+
+
+class CacheStatsView(APIView):
+    """Счетчики попаданий и промахов кэшей текущего процесса."""
+
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return Response({
+            name: cache.stats() for name, cache in cache_registry.items()
+        })
+
+
+class MetricsView(APIView):
+    """Метрики запросов текущего процесса в формате Prometheus."""
+
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request):
+        return HttpResponse(
+            metrics.render(),
+            content_type='text/plain; version=0.0.4; charset=utf-8'
         )
-        pdf_canvas = canvas.Canvas(response)
-        text_object = pdf_canvas.beginText(100, 730)
-        text_object.setFont('FreeSans', 12)
-        text_object.textLine('Список покупок:')
-        for ingredient in queryset_ingredients:
-            pdf_text = (f'{ingredient.name} '
-                        f'({ingredient.measurement_unit}) — '
-                        f'{ingredient.sum_amount_ingredients}')
-            text_object.textLine(pdf_text)
-        pdf_canvas.drawText(text_object)
-        pdf_canvas.setTitle('Ваш список покупок')
-        pdf_canvas.save()
-        return response
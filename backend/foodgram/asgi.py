@@ -9,8 +9,15 @@ https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
+os.environ.setdefault('SERVER_MODE', 'asgi')
 
-application = get_asgi_application()
+# Как get_asgi_application(), но потоковые ответы перебираются вне цикла
+# событий (StreamingASGIHandler).
+django.setup(set_prefix=False)
+
+from api.async_views import StreamingASGIHandler  # noqa: E402
+
+application = StreamingASGIHandler()
@@ -0,0 +1,34 @@
+from django.db import models
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+def casefold(value):
+    return None if value is None else value.casefold()
+
+
+class Casefold(models.Func):
+    """
+    Строка для сравнения без учета регистра.
+
+    Встроенные LOWER() и LIKE в SQLite меняют регистр только латиницы,
+    поэтому там используется функция CASEFOLD на Python (str.casefold),
+    на остальных СУБД - LOWER().
+    """
+
+    function = 'LOWER'
+    output_field = models.TextField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return super().as_sql(
+            compiler, connection, function='CASEFOLD', **extra_context
+        )
+
+
+@receiver(connection_created)
+def register_sqlite_functions(connection, **kwargs):
+    """Функция CASEFOLD в каждом новом подключении к SQLite."""
+    if connection.vendor == 'sqlite':
+        connection.connection.create_function(
+            'CASEFOLD', 1, casefold, deterministic=True
+        )
@@ -0,0 +1,81 @@
+import asyncio
+import hashlib
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from .routers import choose_replica, read_alias
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class ReplicaMiddleware:
+    """
+    Безопасные запросы читают с реплики, остальные - с основной базы.
+
+    После изменяющего запроса клиент (по токену или сессии) в течение
+    REPLICA_STICKY_SECONDS читает с основной базы, чтобы видеть свои
+    изменения до того, как они дойдут до реплик.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    @staticmethod
+    def get_sticky_key(request):
+        client = (
+            request.META.get('HTTP_AUTHORIZATION')
+            or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+        )
+        if not client:
+            return None
+        return 'db-primary:' + hashlib.sha256(client.encode()).hexdigest()
+
+    @staticmethod
+    def get_read_alias(request, key):
+        if request.method in SAFE_METHODS and (
+            key is None or not cache.get(key)
+        ):
+            return choose_replica()
+        return None
+
+    @staticmethod
+    def remember_write(request, key):
+        if request.method not in SAFE_METHODS and key is not None:
+            cache.set(key, True, settings.REPLICA_STICKY_SECONDS)
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+        key = self.get_sticky_key(request)
+        token = read_alias.set(self.get_read_alias(request, key))
+        try:
+            response = self.get_response(request)
+        finally:
+            read_alias.reset(token)
+        self.remember_write(request, key)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return await self.get_response(request)
+        key = self.get_sticky_key(request)
+        token = read_alias.set(await sync_to_async(
+            self.get_read_alias, thread_sensitive=False
+        )(request, key))
+        try:
+            response = await self.get_response(request)
+        finally:
+            read_alias.reset(token)
+        await sync_to_async(
+            self.remember_write, thread_sensitive=False
+        )(request, key)
+        return response
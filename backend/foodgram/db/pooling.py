@@ -0,0 +1,88 @@
+import threading
+import time
+from collections import Counter
+
+
+class ConnectionStats:
+    """Счетчики подключений к базе в текущем процессе по alias."""
+
+    events = ('opened', 'reused', 'closed', 'health_check_failed')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = Counter()
+        self.connect_time = Counter()
+
+    def add(self, alias, event):
+        with self._lock:
+            self.counts[alias, event] += 1
+
+    def add_connect_time(self, alias, seconds):
+        with self._lock:
+            self.connect_time[alias] += seconds
+
+    def snapshot(self):
+        with self._lock:
+            aliases = {alias for alias, _ in self.counts}
+            return {
+                alias: {
+                    **{
+                        event: self.counts[alias, event]
+                        for event in self.events
+                    },
+                    'open': (
+                        self.counts[alias, 'opened']
+                        - self.counts[alias, 'closed']
+                    ),
+                    'connect_seconds': self.connect_time[alias],
+                }
+                for alias in sorted(aliases)
+            }
+
+
+stats = ConnectionStats()
+
+
+class PersistentConnectionMixin:
+    """
+    Постоянные подключения с проверкой перед повторным использованием.
+
+    Подключение живет в своем потоке не дольше CONN_MAX_AGE. При
+    CONN_HEALTH_CHECKS подключение, оставшееся от предыдущего запроса,
+    проверяется при первом обращении к базе в новом запросе (запросы без
+    обращений к базе ничего не проверяют), неработающее закрывается и
+    открывается заново.
+    """
+
+    health_check_done = False
+
+    def connect(self):
+        started_at = time.perf_counter()
+        super().connect()
+        stats.add_connect_time(self.alias, time.perf_counter() - started_at)
+        stats.add(self.alias, 'opened')
+        self.health_check_done = True
+
+    def close(self):
+        was_open = self.connection is not None
+        super().close()
+        if was_open and self.connection is None:
+            stats.add(self.alias, 'closed')
+
+    def close_if_unusable_or_obsolete(self):
+        super().close_if_unusable_or_obsolete()
+        self.health_check_done = False
+
+    def ensure_connection(self):
+        if self.connection is not None and not self.health_check_done:
+            self.health_check_done = True
+            if (
+                self.settings_dict.get('CONN_HEALTH_CHECKS')
+                and not self.in_atomic_block
+                and not self.is_usable()
+            ):
+                stats.add(self.alias, 'health_check_failed')
+                self.close()
+            else:
+                stats.add(self.alias, 'reused')
+        super().ensure_connection()
@@ -0,0 +1,7 @@
+from django.db.backends.postgresql import base
+
+from ..pooling import PersistentConnectionMixin
+
+
+class DatabaseWrapper(PersistentConnectionMixin, base.DatabaseWrapper):
+    """PostgreSQL с постоянными подключениями и их проверкой."""
@@ -0,0 +1,50 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+read_alias = ContextVar('read_alias', default=None)
+
+
+def choose_replica():
+    """Реплика для чтения в текущем запросе (None - основная база)."""
+    replicas = settings.DATABASE_REPLICAS
+    return random.choice(replicas) if replicas else None
+
+
+@contextmanager
+def use_primary():
+    """Чтение с основной базы внутри блока."""
+    token = read_alias.set(None)
+    try:
+        yield
+    finally:
+        read_alias.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Чтение с реплики, выбранной для запроса (ReplicaMiddleware), запись -
+    в основную базу.
+
+    Вне запросов (команды, фоновые потоки), внутри транзакций основной
+    базы и в блоках use_primary() чтение идет с основной базы. Миграции
+    применяются только к основной базе: реплики получают их репликацией.
+    """
+
+    def db_for_read(self, model, **hints):
+        alias = read_alias.get()
+        if alias is None or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return alias
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db not in settings.DATABASE_REPLICAS
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pathlib import Path
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -19,6 +20,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
     'colorfield',
@@ -32,6 +34,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',
+    'foodgram.db.middleware.ReplicaMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -62,17 +66,48 @@ TEMPLATES = [
 WSGI_APPLICATION = 'foodgram.wsgi.application'
 
 
+# DB_POOLER=pgbouncer: подключение через pgbouncer в режиме transaction
+# (DB_HOST/DB_PORT указывают на pgbouncer). Серверные курсоры в этом
+# режиме не работают и отключаются.
+DB_POOLER = os.getenv('DB_POOLER', '')
+
 DATABASES = {
     'default': {
-        'ENGINE': os.getenv('DB_ENGINE', 'django.db.backends.postgresql'),
+        'ENGINE': os.getenv('DB_ENGINE', 'foodgram.db.postgresql'),
         'NAME': os.getenv('POSTGRES_DB', 'foodgram'),
         'USER': os.getenv('POSTGRES_USER', 'foodgram_user'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', 'foodgram_password'),
         'HOST': os.getenv('DB_HOST', 'db'),
-        'PORT': os.getenv('DB_PORT', 5432)
+        'PORT': os.getenv('DB_PORT', 5432),
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': os.getenv('DB_HEALTH_CHECKS', 'True') == 'True',
+        'DISABLE_SERVER_SIDE_CURSORS': DB_POOLER == 'pgbouncer',
     }
 }
 
+# Реплики для чтения: DB_REPLICA_HOSTS - адреса (host или host:port),
+# DB_REPLICA_NAMES - имена баз, если отличаются от основной (для SQLite -
+# пути к файлам). Записи идут в основную базу.
+DB_REPLICA_HOSTS = [
+    host.strip() for host in os.getenv('DB_REPLICA_HOSTS', '').split(',')
+    if host.strip()
+]
+DB_REPLICA_NAMES = [
+    name.strip() for name in os.getenv('DB_REPLICA_NAMES', '').split(',')
+    if name.strip()
+]
+for number in range(max(len(DB_REPLICA_HOSTS), len(DB_REPLICA_NAMES))):
+    replica = dict(DATABASES['default'], TEST={'MIRROR': 'default'})
+    if number < len(DB_REPLICA_HOSTS):
+        replica['HOST'], _, port = DB_REPLICA_HOSTS[number].partition(':')
+        replica['PORT'] = port or replica['PORT']
+    if number < len(DB_REPLICA_NAMES):
+        replica['NAME'] = DB_REPLICA_NAMES[number]
+    DATABASES[f'replica_{number}'] = replica
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['foodgram.db.routers.ReplicaRouter']
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', 5))
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -109,9 +144,23 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+DEFAULT_FILE_STORAGE = 'recipes.storage.ContentAddressedStorage'
 
 AUTH_USER_MODEL = 'users.User'
 
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.filebased.FileBasedCache'
+        ),
+        'LOCATION': os.getenv(
+            'CACHE_LOCATION',
+            os.path.join(tempfile.gettempdir(), 'foodgram-cache')
+        ),
+    }
+}
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
@@ -122,12 +171,36 @@ REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.LimitOffsetPagination',
 }
 
 
+# wsgi или asgi; foodgram.asgi выставляет asgi сам.
+SERVER_MODE = os.getenv('SERVER_MODE', 'wsgi')
+
+IMAGE_PROCESSING_SYNC = os.getenv('IMAGE_PROCESSING_SYNC') == 'True'
+
+INGREDIENT_SEARCH_LIMIT = int(os.getenv('INGREDIENT_SEARCH_LIMIT', 50))
+INGREDIENT_INDEX_TTL = int(os.getenv('INGREDIENT_INDEX_TTL', 300))
+PANTRY_INDEX_TTL = int(os.getenv('PANTRY_INDEX_TTL', 300))
+TAG_INDEX_TTL = int(os.getenv('TAG_INDEX_TTL', 300))
+
+CATALOGUE_CACHE_TTL = int(os.getenv('CATALOGUE_CACHE_TTL', 3600))
+CATALOGUE_CACHE_LOCAL_TTL = int(os.getenv('CATALOGUE_CACHE_LOCAL_TTL', 60))
+CATALOGUE_CACHE_SIZE = int(os.getenv('CATALOGUE_CACHE_SIZE', 256))
+RECIPE_CACHE_TTL = int(os.getenv('RECIPE_CACHE_TTL', 600))
+RECIPE_CACHE_LOCAL_TTL = int(os.getenv('RECIPE_CACHE_LOCAL_TTL', 60))
+RECIPE_CACHE_SIZE = int(os.getenv('RECIPE_CACHE_SIZE', 512))
+USER_FLAGS_CACHE_TTL = int(os.getenv('USER_FLAGS_CACHE_TTL', 300))
+TOKEN_CACHE_TTL = int(os.getenv('TOKEN_CACHE_TTL', 60))
+TOKEN_CACHE_LOCAL_TTL = int(os.getenv('TOKEN_CACHE_LOCAL_TTL', 5))
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 4096))
+
+METRICS_SLOW_REQUEST_MS = int(os.getenv('METRICS_SLOW_REQUEST_MS', 0))
+
+
 DJOSER = {
     'SERIALIZERS': {
         'user': 'api.serializers.CustomUserSerializer',
@@ -5,6 +5,10 @@ from .models import (
     Recipe, Tag, Ingredient, Favorite,
     RecipeIngredient, Cart
 )
+from .services import (
+    change_recipe_in_shopping_lists, delete_recipe, get_recipe_amounts,
+    update_recipe_indexes
+)
 
 
 class IngredientInline(admin.TabularInline):
@@ -23,7 +27,7 @@ class IngredientInline(admin.TabularInline):
 @admin.register(Recipe)
 class RecipAdmin(admin.ModelAdmin):
     list_display = (
-        'id', 'name', 'cooking_time', 'author'
+        'id', 'name', 'cooking_time', 'author', 'favorites'
     )
     list_editable = ('name', 'cooking_time')
     list_filter = ('name', 'author', 'tags')
@@ -31,10 +35,28 @@ class RecipAdmin(admin.ModelAdmin):
     min_num = 1
     inlines = [IngredientInline]
 
+    @admin.display(description='В избранном', ordering='favorites_count')
     def favorites(self, obj):
-        if Favorite.objects.filter(recipe=obj).exists():
-            return Favorite.objects.filter(recipe=obj).count()
-        return 0
+        return obj.favorites_count
+
+    def save_related(self, request, form, formsets, change):
+        """
+        Состав рецепта из формы: обновляются индексы и списки покупок
+        тех, у кого рецепт в корзине.
+        """
+        recipe = form.instance
+        old_amounts = get_recipe_amounts(recipe) if change else {}
+        super().save_related(request, form, formsets, change)
+        new_amounts = get_recipe_amounts(recipe)
+        update_recipe_indexes(recipe.pk, list(new_amounts))
+        change_recipe_in_shopping_lists(recipe, old_amounts, new_amounts)
+
+    def delete_model(self, request, obj):
+        delete_recipe(obj)
+
+    def delete_queryset(self, request, queryset):
+        for recipe in queryset:
+            delete_recipe(recipe)
 
 
 @admin.register(Tag)
@@ -0,0 +1,246 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.authtoken.models import Token
+
+from foodgram.db.routers import use_primary
+from users.models import Follow
+from .models import Cart, CatalogueVersion, Favorite, Tag
+from .services import get_catalogue_versions
+
+MISSING = object()
+TOKEN_USER_FIELDS = (
+    'id', 'email', 'username', 'first_name', 'last_name', 'is_active',
+    'is_staff', 'is_superuser'
+)
+registry = {}
+
+
+class TwoTierCache:
+    """
+    Двухуровневый кэш: LRU с TTL в памяти процесса поверх общего кэша
+    Django (settings.CACHES, по умолчанию файловый).
+
+    Значение ищется сначала в памяти процесса, затем в общем кэше, и
+    только при промахе в обоих вычисляется. Ключи общего кэша содержат
+    поколение, invalidate() увеличивает его и очищает память процесса:
+    в других процессах старые значения живут не дольше local_ttl. В
+    строгом режиме (strict) поколение читается из общего кэша при каждом
+    обращении, и сброс сразу виден всем процессам. Значения вычисляются
+    по основной базе: отставание реплик не попадает в кэш.
+    Счетчики попаданий и промахов ведутся в каждом процессе отдельно.
+    """
+
+    def __init__(self, name, local_ttl, maxsize, shared_ttl, alias='default',
+                 strict=False):
+        self.name = name
+        self.local_ttl = local_ttl
+        self.maxsize = maxsize
+        self.shared_ttl = shared_ttl
+        self.alias = alias
+        self.strict = strict
+        self.generation_key = f'{name}:generation'
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self.local_hits = self.shared_hits = self.misses = 0
+        registry[name] = self
+
+    def _get_local(self, key, generation):
+        with self._lock:
+            expires_at, built_for, value = self._local.get(
+                key, (0, None, MISSING)
+            )
+            if expires_at < time.monotonic() or built_for != generation:
+                self._local.pop(key, None)
+                return MISSING
+            self._local.move_to_end(key)
+            return value
+
+    def _set_local(self, key, generation, value):
+        with self._lock:
+            self._local[key] = (
+                time.monotonic() + self.local_ttl, generation, value
+            )
+            self._local.move_to_end(key)
+            while len(self._local) > self.maxsize:
+                self._local.popitem(last=False)
+
+    def get_or_set(self, key, default):
+        """Значение по ключу; при промахе - default() с сохранением."""
+        shared = caches[self.alias]
+        generation = (
+            shared.get(self.generation_key, 1) if self.strict else None
+        )
+        value = self._get_local(key, generation)
+        if value is not MISSING:
+            self.local_hits += 1
+            return value
+        if generation is None:
+            local_generation, generation = None, shared.get(
+                self.generation_key, 1
+            )
+        else:
+            local_generation = generation
+        shared_key = f'{self.name}:{key}'
+        value = shared.get(shared_key, MISSING, version=generation)
+        if value is MISSING:
+            self.misses += 1
+            with use_primary():
+                value = default()
+            shared.set(
+                shared_key, value, self.shared_ttl, version=generation
+            )
+        else:
+            self.shared_hits += 1
+        self._set_local(key, local_generation, value)
+        return value
+
+    def delete(self, key):
+        """
+        Сброс одного значения: в памяти этого процесса и в общем кэше.
+        В других процессах оно живет не дольше local_ttl.
+        """
+        with self._lock:
+            self._local.pop(key, None)
+        shared = caches[self.alias]
+        shared.delete(
+            f'{self.name}:{key}',
+            version=shared.get(self.generation_key, 1)
+        )
+
+    def invalidate(self):
+        with self._lock:
+            self._local.clear()
+        shared = caches[self.alias]
+        try:
+            shared.incr(self.generation_key)
+        except ValueError:
+            shared.set(self.generation_key, 2, None)
+
+    def stats(self):
+        return {
+            'local_hits': self.local_hits,
+            'shared_hits': self.shared_hits,
+            'misses': self.misses,
+            'local_size': len(self._local),
+        }
+
+
+catalogue_cache = TwoTierCache(
+    'catalogue',
+    local_ttl=settings.CATALOGUE_CACHE_LOCAL_TTL,
+    maxsize=settings.CATALOGUE_CACHE_SIZE,
+    shared_ttl=settings.CATALOGUE_CACHE_TTL,
+)
+
+recipe_cache = TwoTierCache(
+    'recipes',
+    local_ttl=settings.RECIPE_CACHE_LOCAL_TTL,
+    maxsize=settings.RECIPE_CACHE_SIZE,
+    shared_ttl=settings.RECIPE_CACHE_TTL,
+    strict=True,
+)
+
+token_cache = TwoTierCache(
+    'tokens',
+    local_ttl=settings.TOKEN_CACHE_LOCAL_TTL,
+    maxsize=settings.TOKEN_CACHE_SIZE,
+    shared_ttl=settings.TOKEN_CACHE_TTL,
+)
+
+
+def get_tag_map():
+    """
+    Теги {id: Tag} из кэша справочников. Ключ содержит версию
+    справочника тегов, поэтому после изменения тегов в любом процессе
+    старая карта не используется.
+    """
+    version, _ = get_catalogue_versions().get(
+        CatalogueVersion.TAG, (0, None)
+    )
+    return catalogue_cache.get_or_set(
+        f'tags:{version}',
+        lambda: {tag.pk: tag for tag in Tag.objects.all()}
+    )
+
+
+def get_user_flags_key(user_id):
+    return f'user-flags:{user_id}'
+
+
+def get_user_flags(user):
+    """
+    Персональные признаки для списков рецептов: id избранных рецептов,
+    рецептов в корзине и авторов, на которых подписан пользователь.
+
+    Хранятся только в общем кэше, сбрасываются при изменении избранного,
+    корзины и подписок (invalidate_user_flags). Читаются с основной базы.
+    """
+    shared = caches['default']
+    key = get_user_flags_key(user.pk)
+    flags = shared.get(key)
+    if flags is None:
+        with use_primary():
+            flags = load_user_flags(user)
+        shared.set(key, flags, settings.USER_FLAGS_CACHE_TTL)
+    return flags
+
+
+def load_user_flags(user):
+    return {
+        'favorites': frozenset(Favorite.objects.filter(
+            user=user
+        ).values_list('recipe_id', flat=True)),
+        'cart': frozenset(Cart.objects.filter(
+            user=user
+        ).values_list('recipe_id', flat=True)),
+        'following': frozenset(Follow.objects.filter(
+            user=user
+        ).values_list('following_id', flat=True)),
+    }
+
+
+def invalidate_user_flags(user_id):
+    caches['default'].delete(get_user_flags_key(user_id))
+
+
+def get_token_cache_key(key):
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def get_token_snapshot(key):
+    """
+    Данные для аутентификации по токену: (дата создания токена, значения
+    полей пользователя TOKEN_USER_FIELDS) или None, если токена нет.
+
+    Хранятся в token_cache под хешем токена: в памяти процесса не дольше
+    TOKEN_CACHE_LOCAL_TTL, в общем кэше - TOKEN_CACHE_TTL; сам токен и
+    пароль в кэш не попадают. Сбрасываются по одному при удалении токена
+    и изменении пользователя (invalidate_token): в этом процессе и общем
+    кэше сразу, в остальных процессах - через TOKEN_CACHE_LOCAL_TTL.
+    Отсутствующие токены не кэшируются.
+    """
+
+    def load():
+        snapshot = Token.objects.filter(key=key).values_list(
+            'created', *(f'user__{field}' for field in TOKEN_USER_FIELDS)
+        ).first()
+        if snapshot is None:
+            raise Token.DoesNotExist
+        return snapshot
+
+    try:
+        created, *values = token_cache.get_or_set(
+            get_token_cache_key(key), load
+        )
+    except Token.DoesNotExist:
+        return None
+    return created, values
+
+
+def invalidate_token(key):
+    token_cache.delete(get_token_cache_key(key))
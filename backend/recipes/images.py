@@ -0,0 +1,122 @@
+import logging
+import os
+import queue
+import threading
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .cache import recipe_cache
+from .models import Recipe
+from .services import change_image_references
+
+logger = logging.getLogger(__name__)
+
+RENDITIONS = {
+    'image_thumbnail': (480, 480),
+    'image_detail': (1200, 1200),
+}
+JPEG_QUALITY = 85
+
+
+def encode(image, image_format):
+    """Кодирует изображение заново: метаданные (EXIF и т.п.) не переносятся."""
+    if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    buffer = BytesIO()
+    image.save(buffer, format=image_format, quality=JPEG_QUALITY,
+               optimize=True)
+    return ContentFile(buffer.getvalue())
+
+
+def process_recipe_image(recipe_id):
+    """
+    Обработка загруженного изображения рецепта.
+
+    Оригинал поворачивается согласно EXIF и сохраняется без метаданных,
+    для списков и страницы рецепта создаются уменьшенные копии. Если за
+    время обработки изображение рецепта сменилось, результат отбрасывается:
+    файлы без ссылок удалит gc_images. Иначе сбрасывается кэш списков
+    рецептов, в которых выводятся уменьшенные копии.
+    """
+    recipe = Recipe.objects.filter(pk=recipe_id).only(
+        'image', *RENDITIONS
+    ).first()
+    if recipe is None or not recipe.image:
+        return
+    source = recipe.image.name
+    previous = [source] + [
+        getattr(recipe, field).name for field in RENDITIONS
+    ]
+    with recipe.image.open('rb') as file:
+        image = Image.open(file)
+        image_format = image.format or 'PNG'
+        if image_format == 'MPO':
+            image_format = 'JPEG'
+        image = ImageOps.exif_transpose(image)
+    filename = os.path.basename(source)
+    recipe.image.save(filename, encode(image, image_format), save=False)
+    for field, size in RENDITIONS.items():
+        rendition = image.copy()
+        rendition.thumbnail(size)
+        getattr(recipe, field).save(
+            filename, encode(rendition, image_format), save=False
+        )
+    names = {
+        field: getattr(recipe, field).name for field in ('image', *RENDITIONS)
+    }
+    with transaction.atomic():
+        if Recipe.objects.filter(pk=recipe_id, image=source).update(
+            updated_at=timezone.now(), **names
+        ):
+            change_image_references(added=names.values(), removed=previous)
+            transaction.on_commit(recipe_cache.invalidate)
+
+
+class ImageWorker:
+    """
+    Фоновая обработка изображений в отдельном потоке процесса.
+
+    Задачи ставятся в локальную очередь после фиксации транзакции и
+    выполняются по одной. При IMAGE_PROCESSING_SYNC обработка идет сразу
+    в текущем потоке (удобно для отладки и management-команд).
+    """
+
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self.run, name='image-worker', daemon=True
+                )
+                self.thread.start()
+
+    def submit(self, recipe_id):
+        if settings.IMAGE_PROCESSING_SYNC:
+            process_recipe_image(recipe_id)
+            return
+        self.start()
+        self.queue.put(recipe_id)
+
+    def run(self):
+        while True:
+            recipe_id = self.queue.get()
+            try:
+                process_recipe_image(recipe_id)
+            except Exception:
+                logger.exception('Ошибка обработки изображения рецепта %s',
+                                 recipe_id)
+            finally:
+                close_old_connections()
+                self.queue.task_done()
+
+
+image_worker = ImageWorker()
@@ -0,0 +1,364 @@
+import heapq
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+from itertools import chain
+
+from django.conf import settings
+
+from foodgram.db.routers import use_primary
+from .models import Ingredient, RecipeIngredient, Tag
+
+WORD_SEPARATORS = frozenset(' -,.()«»"/')
+
+
+class InProcessIndex:
+    """
+    Базовый класс индекса в памяти процесса.
+
+    Индекс строится лениво при первом обращении, сбрасывается методом
+    invalidate() (по сигналам об изменении данных) и перестраивается
+    не реже раза в ttl секунд, чтобы подхватывать изменения, сделанные
+    в других процессах. Если вызывающий код передает версию данных
+    (например, версию справочника, по которой построен ETag), индекс
+    перестраивается и при ее смене. Данные читаются с основной базы.
+    """
+
+    ttl = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._built_generation = None
+        self._built_version = None
+        self._built_at = None
+
+    def build(self):
+        raise NotImplementedError
+
+    def invalidate(self):
+        self._generation += 1
+
+    def is_fresh(self, version=None):
+        return (
+            self._built_generation == self._generation
+            and (version is None or self._built_version == version)
+            and (
+                self.ttl is None
+                or time.monotonic() - self._built_at < self.ttl
+            )
+        )
+
+    def ensure_built(self, version=None):
+        if self.is_fresh(version):
+            return
+        with self._lock:
+            if self.is_fresh(version):
+                return
+            generation = self._generation
+            with use_primary():
+                self.build()
+            self._built_at = time.monotonic()
+            self._built_generation = generation
+            self._built_version = version
+
+
+class IngredientIndex(InProcessIndex):
+    """
+    Индекс для автодополнения ингредиентов.
+
+    Названия хранятся в отсортированном массиве, поиск по началу строки
+    выполняется бинарным поиском. Для поиска по вхождению используется
+    массив суффиксов названий: все суффиксы, начинающиеся с запроса,
+    лежат в нем подряд.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.ttl = settings.INGREDIENT_INDEX_TTL
+        self._keys = []
+        self._items = []
+        self._by_id = {}
+        self._suffixes = []
+        self._suffix_refs = []
+
+    def build(self):
+        rows = sorted(
+            (name.casefold(), name, pk, measurement_unit)
+            for pk, name, measurement_unit in Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit'
+            )
+        )
+        suffixes = sorted(
+            (key[position:], position, number)
+            for number, (key, *_) in enumerate(rows)
+            for position in range(1, len(key))
+        )
+        self._keys = [key for key, *_ in rows]
+        self._items = [
+            {'id': pk, 'name': name, 'measurement_unit': measurement_unit}
+            for _, name, pk, measurement_unit in rows
+        ]
+        self._by_id = {item['id']: item for item in self._items}
+        self._suffixes = [suffix for suffix, *_ in suffixes]
+        self._suffix_refs = [
+            (position, number) for _, position, number in suffixes
+        ]
+
+    def get(self, pk):
+        """Ингредиент по id без обращения к базе."""
+        self.ensure_built()
+        return self._by_id.get(pk)
+
+    def search(self, query, limit, version=None):
+        """
+        Сначала ингредиенты, начинающиеся с query, затем содержащие его.
+
+        Вхождения ранжируются: совпадение с началом слова выше, затем
+        по позиции вхождения и длине названия. version - версия
+        справочника ингредиентов, которой должны соответствовать данные.
+        """
+        self.ensure_built(version)
+        query = query.strip().casefold()
+        if not query or limit <= 0:
+            return []
+        keys, items = self._keys, self._items
+        found = []
+        index = bisect_left(keys, query)
+        while (
+            index < len(keys) and len(found) < limit
+            and keys[index].startswith(query)
+        ):
+            found.append(index)
+            index += 1
+        if len(found) == limit:
+            return [items[number] for number in found]
+        best = {}
+        index = bisect_left(self._suffixes, query)
+        while (
+            index < len(self._suffixes)
+            and self._suffixes[index].startswith(query)
+        ):
+            position, number = self._suffix_refs[index]
+            if not keys[number].startswith(query):
+                rank = (
+                    keys[number][position - 1] not in WORD_SEPARATORS,
+                    position,
+                    len(keys[number]),
+                    number,
+                )
+                best[number] = min(rank, best.get(number, rank))
+            index += 1
+        found.extend(
+            rank[-1] for rank in heapq.nsmallest(
+                limit - len(found), best.values()
+            )
+        )
+        return [items[number] for number in found]
+
+
+class TagIndex(InProcessIndex):
+    """
+    Соответствие slug -> id тегов для фильтрации рецептов.
+
+    Вызывающий код передает версию справочника тегов: после изменения
+    тегов в другом процессе индекс перестраивается сразу, не дожидаясь
+    ttl.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.ttl = settings.TAG_INDEX_TTL
+        self._ids = {}
+
+    def build(self):
+        self._ids = dict(Tag.objects.values_list('slug', 'id'))
+
+    def choices(self, version=None):
+        self.ensure_built(version)
+        return [(slug, slug) for slug in self._ids]
+
+    def get_ids(self, slugs, version=None):
+        """Id тегов по slug; неизвестные slug пропускаются."""
+        self.ensure_built(version)
+        ids = self._ids
+        return [ids[slug] for slug in slugs if slug in ids]
+
+
+class PantryMatches:
+    """
+    Рецепты, подобранные по имеющимся ингредиентам.
+
+    Последовательность кортежей (id рецепта, доля имеющихся ингредиентов,
+    id недостающих ингредиентов) по убыванию доли, затем по числу
+    недостающих и новизне рецепта. Совпадения посчитаны отдельно для
+    рецептов каждого размера, поэтому доля определяется парой
+    (совпало, размер): упорядочиваются только такие пары, а рецепты
+    группы отбираются при первом обращении к ней.
+    """
+
+    def __init__(self, counts, ingredients, pantry):
+        self.counts = counts
+        self.ingredients = ingredients
+        self.pantry = pantry
+        self.count = sum(len(matches) for matches in counts.values())
+        pairs, lengths = defaultdict(list), Counter()
+        for size, matches in counts.items():
+            for matched, number in Counter(matches.values()).items():
+                key = matched / size, size - matched
+                pairs[key].append((matched, size))
+                lengths[key] += number
+        self.groups = [
+            [key, pairs[key], lengths[key], None]
+            for key in sorted(pairs, key=lambda key: (-key[0], key[1]))
+        ]
+
+    def __len__(self):
+        return self.count
+
+    def get_group(self, group):
+        """Id рецептов группы по убыванию (вычисляются один раз)."""
+        if group[3] is None:
+            group[3] = sorted(
+                (
+                    recipe_id
+                    for matched, size in group[1]
+                    for recipe_id, count in self.counts[size].items()
+                    if count == matched
+                ),
+                reverse=True
+            )
+        return group[3]
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            return self[item:item + 1][0]
+        start, stop, _ = item.indices(self.count)
+        found, offset = [], 0
+        for group in self.groups:
+            if offset >= stop:
+                break
+            if offset + group[2] > start:
+                found.extend(
+                    (recipe_id, group[0][0])
+                    for recipe_id in self.get_group(group)[
+                        max(start - offset, 0):stop - offset
+                    ]
+                )
+            offset += group[2]
+        return [
+            (
+                recipe_id,
+                coverage,
+                [
+                    ingredient_id
+                    for ingredient_id in self.ingredients.get(recipe_id, ())
+                    if ingredient_id not in self.pantry
+                ],
+            )
+            for recipe_id, coverage in found
+        ]
+
+
+class PantryIndex(InProcessIndex):
+    """
+    Обратный индекс «ингредиент -> рецепты» для подбора рецептов.
+
+    Для каждой пары (ингредиент, число ингредиентов в рецепте) хранится
+    отсортированный массив id рецептов, для каждого рецепта - его
+    ингредиенты. Совпадения считаются проходом по массивам выбранных
+    ингредиентов без обращения к базе. Изменения рецептов этого процесса
+    применяются сразу (update_recipe, remove_recipe), изменения из
+    других процессов - при перестроении раз в ttl секунд. Массивы не
+    изменяются на месте, а заменяются копиями, поэтому поиск идет без
+    блокировки.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.ttl = settings.PANTRY_INDEX_TTL
+        self._postings = {}
+        self._ingredients = {}
+        self._sizes = Counter()
+
+    def build(self):
+        ingredients = defaultdict(list)
+        for recipe_id, ingredient_id in RecipeIngredient.objects.order_by(
+            'recipe_id'
+        ).values_list('recipe_id', 'ingredient_id').iterator():
+            ingredients[recipe_id].append(ingredient_id)
+        postings = defaultdict(lambda: array('q'))
+        for recipe_id, ingredient_ids in ingredients.items():
+            for ingredient_id in ingredient_ids:
+                postings[ingredient_id, len(ingredient_ids)].append(recipe_id)
+        self._postings = dict(postings)
+        self._ingredients = {
+            recipe_id: tuple(ingredient_ids)
+            for recipe_id, ingredient_ids in ingredients.items()
+        }
+        self._sizes = Counter(
+            len(ingredient_ids) for ingredient_ids in ingredients.values()
+        )
+
+    def _change_posting(self, key, recipe_id, add):
+        posting = array('q', self._postings.get(key, ()))
+        index = bisect_left(posting, recipe_id)
+        found = index < len(posting) and posting[index] == recipe_id
+        if add and not found:
+            posting.insert(index, recipe_id)
+        elif not add and found:
+            del posting[index]
+        self._postings[key] = posting
+
+    def _remove(self, recipe_id):
+        ingredient_ids = self._ingredients.pop(recipe_id, ())
+        for ingredient_id in ingredient_ids:
+            self._change_posting(
+                (ingredient_id, len(ingredient_ids)), recipe_id, add=False
+            )
+        if ingredient_ids:
+            self._sizes[len(ingredient_ids)] -= 1
+
+    def update_recipe(self, recipe_id, ingredient_ids):
+        """Учет нового состава рецепта."""
+        ingredient_ids = tuple(ingredient_ids)
+        with self._lock:
+            if self._built_generation is None:
+                return
+            self._remove(recipe_id)
+            for ingredient_id in ingredient_ids:
+                self._change_posting(
+                    (ingredient_id, len(ingredient_ids)), recipe_id, add=True
+                )
+            self._ingredients[recipe_id] = ingredient_ids
+            self._sizes[len(ingredient_ids)] += 1
+
+    def remove_recipe(self, recipe_id):
+        """Учет удаления рецепта."""
+        with self._lock:
+            if self._built_generation is not None:
+                self._remove(recipe_id)
+
+    def search(self, ingredient_ids):
+        """Рецепты, содержащие хотя бы один из ingredient_ids."""
+        self.ensure_built()
+        pantry = frozenset(ingredient_ids)
+        postings = self._postings
+        counts = {}
+        for size, recipes in list(self._sizes.items()):
+            if recipes <= 0:
+                continue
+            matches = Counter(chain.from_iterable(
+                postings.get((ingredient_id, size), ())
+                for ingredient_id in pantry
+            ))
+            if matches:
+                counts[size] = matches
+        return PantryMatches(counts, self._ingredients, pantry)
+
+
+ingredient_index = IngredientIndex()
+tag_index = TagIndex()
+pantry_index = PantryIndex()
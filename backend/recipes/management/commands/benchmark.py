@@ -0,0 +1,391 @@
+import base64
+import json
+import math
+import random
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+from io import BytesIO
+from urllib.parse import urlencode
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.authtoken.models import Token
+
+from recipes.cache import catalogue_cache, recipe_cache
+from recipes.models import Ingredient, Recipe, Tag
+from users.models import User
+
+from .seed_benchmark import PREFIX
+
+PAGE_SIZES = (1, 6, 30, 100)
+PERCENTILES = (50, 95, 99)
+
+
+class BenchmarkContext:
+    """Данные для построения запросов сценариев."""
+
+    def __init__(self, user, seed):
+        self.rng = random.Random(seed)
+        self.user = user
+        self.recipe_ids = list(
+            Recipe.objects.order_by('-id').values_list('id', flat=True)[:1000]
+        )
+        self.own_recipe_ids = list(
+            Recipe.objects.filter(author=user).values_list('id', flat=True)
+        )
+        self.tags = list(Tag.objects.values_list('id', 'slug'))
+        self.ingredient_ids = list(
+            Ingredient.objects.values_list('id', flat=True)[:1000]
+        )
+        self.prefixes = sorted({
+            name[:2] for name in Ingredient.objects.values_list(
+                'name', flat=True
+            )[:1000]
+        })
+        buffer = BytesIO()
+        Image.new('RGB', (800, 600), '#80a0c0').save(buffer, 'JPEG')
+        self.image = 'data:image/jpeg;base64,' + base64.b64encode(
+            buffer.getvalue()
+        ).decode()
+        self.counter = 0
+        self.lock = threading.Lock()
+
+    def recipe_data(self):
+        with self.lock:
+            self.counter += 1
+            number = self.counter
+        return {
+            'name': f'{PREFIX} {time.time_ns()} {number}',
+            'text': f'{PREFIX} benchmark recipe {number}',
+            'cooking_time': self.rng.randint(1, 180),
+            'image': self.image,
+            'tags': [tag_id for tag_id, _ in self.rng.sample(
+                self.tags, min(2, len(self.tags))
+            )],
+            'ingredients': [
+                {'id': ingredient_id, 'amount': self.rng.randint(1, 500)}
+                for ingredient_id in self.rng.sample(
+                    self.ingredient_ids, min(6, len(self.ingredient_ids))
+                )
+            ],
+        }
+
+
+def list_page(limit):
+    return lambda context: ('get', f'/api/recipes/?limit={limit}', None)
+
+
+SCENARIOS = {
+    'recipe-list': lambda context: (
+        'get', f'/api/recipes/?page={context.rng.randint(1, 5)}', None
+    ),
+    **{
+        f'recipe-list-limit-{limit}': list_page(limit)
+        for limit in PAGE_SIZES
+    },
+    'recipe-list-tags': lambda context: (
+        'get',
+        '/api/recipes/?' + urlencode([
+            ('tags', slug) for _, slug in context.rng.sample(
+                context.tags, min(2, len(context.tags))
+            )
+        ]),
+        None
+    ),
+    'recipe-list-favorited': lambda context: (
+        'get', '/api/recipes/?is_favorited=1', None
+    ),
+    'recipe-list-in-cart': lambda context: (
+        'get', '/api/recipes/?is_in_shopping_cart=1', None
+    ),
+    'recipe-search': lambda context: (
+        'get',
+        '/api/recipes/?' + urlencode(
+            {'search': context.rng.choice(context.prefixes)}
+        ),
+        None
+    ),
+    'recipe-detail': lambda context: (
+        'get', f'/api/recipes/{context.rng.choice(context.recipe_ids)}/', None
+    ),
+    'subscriptions': lambda context: (
+        'get', '/api/users/subscriptions/?recipes_limit=3', None
+    ),
+    'ingredient-search': lambda context: (
+        'get',
+        '/api/ingredients/?' + urlencode(
+            {'name': context.rng.choice(context.prefixes)}
+        ),
+        None
+    ),
+    'pantry': lambda context: (
+        'get',
+        '/api/recipes/pantry/?' + '&'.join(
+            f'ingredients={ingredient_id}'
+            for ingredient_id in context.rng.sample(
+                context.ingredient_ids, min(10, len(context.ingredient_ids))
+            )
+        ),
+        None
+    ),
+    'shopping-list-txt': lambda context: (
+        'get', '/api/recipes/download_shopping_cart/?file_format=txt', None
+    ),
+    'shopping-list-pdf': lambda context: (
+        'get', '/api/recipes/download_shopping_cart/?file_format=pdf', None
+    ),
+    'recipe-create': lambda context: (
+        'post', '/api/recipes/', context.recipe_data()
+    ),
+    'recipe-update': lambda context: (
+        'patch',
+        f'/api/recipes/{context.rng.choice(context.own_recipe_ids)}/',
+        context.recipe_data()
+    ),
+}
+
+
+def percentile(values, rank):
+    """Процентиль методом ближайшего ранга по отсортированным значениям."""
+    return values[max(math.ceil(rank / 100 * len(values)) - 1, 0)]
+
+
+def summarize(latencies, queries, errors, elapsed):
+    latencies = sorted(latencies)
+    result = {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 2),
+        'latency_ms': {
+            'mean': round(sum(latencies) / len(latencies), 3),
+            **{
+                f'p{rank}': round(percentile(latencies, rank), 3)
+                for rank in PERCENTILES
+            },
+            'max': round(latencies[-1], 3),
+        },
+        'queries': None,
+    }
+    if queries:
+        result['queries'] = {
+            'min': min(queries),
+            'max': max(queries),
+            'mean': round(sum(queries) / len(queries), 2),
+        }
+    return result
+
+
+class Command(BaseCommand):
+    help = (
+        'measuring throughput, latency percentiles and SQL query counts of '
+        'the main API endpoints on data from seed_benchmark'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*',
+                            help=f'default: all of {", ".join(SCENARIOS)}')
+        parser.add_argument('--requests', default=100, type=int,
+                            help='measured requests per scenario')
+        parser.add_argument('--warmup', default=5, type=int)
+        parser.add_argument('--concurrency', default=1, type=int)
+        parser.add_argument('--url',
+                            help='base URL of a running server; by default '
+                                 'requests go through the Django test client '
+                                 'in this process and SQL queries are counted')
+        parser.add_argument('--host', default='127.0.0.1',
+                            help='Host header for the test client')
+        parser.add_argument('--cold-cache', action='store_true',
+                            help='reset recipe and catalogue caches before '
+                                 'every request')
+        parser.add_argument('--seed', default=0, type=int)
+        parser.add_argument('--output', help='write results to a JSON file')
+        parser.add_argument('--compare',
+                            help='JSON file of a previous run to compare with')
+
+    def get_user(self):
+        user = User.objects.filter(
+            username__startswith=PREFIX
+        ).order_by('id').first()
+        if user is None:
+            raise CommandError('Нет данных: сначала выполните seed_benchmark.')
+        return user
+
+    def make_sender(self, options, token):
+        """Функция отправки запроса: (статус, число SQL-запросов)."""
+        if options['url']:
+            base_url = options['url'].rstrip('/')
+
+            def send(method, path, data):
+                request = urllib.request.Request(
+                    base_url + path,
+                    data=None if data is None else json.dumps(data).encode(),
+                    method=method.upper(),
+                    headers={
+                        'Authorization': f'Token {token}',
+                        'Content-Type': 'application/json',
+                    }
+                )
+                try:
+                    with urllib.request.urlopen(request) as response:
+                        response.read()
+                        return response.status, None
+                except urllib.error.HTTPError as error:
+                    return error.code, None
+
+            return send
+        local = threading.local()
+
+        def send(method, path, data):
+            if not hasattr(local, 'client'):
+                local.client = Client(
+                    HTTP_AUTHORIZATION=f'Token {token}',
+                    HTTP_HOST=options['host']
+                )
+            kwargs = {} if data is None else {
+                'data': json.dumps(data), 'content_type': 'application/json'
+            }
+            with CaptureQueriesContext(connection) as queries:
+                response = getattr(local.client, method)(path, **kwargs)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                response.close()
+            return response.status_code, len(queries.captured_queries)
+
+        return send
+
+    def run_scenario(self, name, context, send, options):
+        make_request = SCENARIOS[name]
+        latencies, queries = [], []
+        errors = 0
+        remaining = iter(range(options['requests']))
+        lock = threading.Lock()
+
+        def request_once():
+            if options['cold_cache']:
+                recipe_cache.invalidate()
+                catalogue_cache.invalidate()
+            method, path, data = make_request(context)
+            started = time.perf_counter()
+            status_code, query_count = send(method, path, data)
+            return (
+                (time.perf_counter() - started) * 1000,
+                query_count,
+                status_code >= 400
+            )
+
+        def worker():
+            nonlocal errors
+            try:
+                while True:
+                    with lock:
+                        if next(remaining, None) is None:
+                            return
+                    latency, query_count, failed = request_once()
+                    with lock:
+                        latencies.append(latency)
+                        if query_count is not None:
+                            queries.append(query_count)
+                        errors += failed
+            finally:
+                connection.close()
+
+        for _ in range(options['warmup']):
+            request_once()
+        started = time.perf_counter()
+        threads = [
+            threading.Thread(target=worker)
+            for _ in range(options['concurrency'])
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return summarize(
+            latencies, queries, errors, time.perf_counter() - started
+        )
+
+    def get_meta(self, options):
+        try:
+            commit = subprocess.run(
+                ('git', 'rev-parse', '--short', 'HEAD'),
+                capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            'commit': commit,
+            'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'database': connection.vendor,
+            'mode': 'http' if options['url'] else 'in-process',
+            'requests': options['requests'],
+            'concurrency': options['concurrency'],
+            'cold_cache': options['cold_cache'],
+            'dataset': {
+                'users': User.objects.count(),
+                'recipes': Recipe.objects.count(),
+                'ingredients': Ingredient.objects.count(),
+            },
+        }
+
+    def compare(self, results, filename):
+        with open(filename, encoding='utf-8') as file:
+            previous = json.load(file)['results']
+        self.stdout.write('\nСравнение с ' + filename)
+        for name, result in results.items():
+            if name not in previous:
+                continue
+            before, after = (
+                previous[name]['latency_ms']['p95'],
+                result['latency_ms']['p95']
+            )
+            line = (
+                f'{name:28} p95 {before:9.2f} -> {after:9.2f} мс '
+                f'({(after - before) / before * 100 if before else 0:+.1f}%)'
+            )
+            if previous[name]['queries'] and result['queries']:
+                line += (
+                    f', SQL {previous[name]["queries"]["mean"]} -> '
+                    f'{result["queries"]["mean"]}'
+                )
+            self.stdout.write(line)
+
+    def handle(self, *args, **options):
+        names = options['scenarios'] or list(SCENARIOS)
+        if unknown := set(names) - SCENARIOS.keys():
+            raise CommandError(
+                f'Неизвестные сценарии: {", ".join(sorted(unknown))}'
+            )
+        user = self.get_user()
+        token, _ = Token.objects.get_or_create(user=user)
+        context = BenchmarkContext(user, options['seed'])
+        if not context.own_recipe_ids and 'recipe-update' in names:
+            names.remove('recipe-update')
+        send = self.make_sender(options, token.key)
+        results = {}
+        for name in names:
+            results[name] = result = self.run_scenario(
+                name, context, send, options
+            )
+            latency = result['latency_ms']
+            queries = result['queries']
+            self.stdout.write(
+                f'{name:28} {result["throughput_rps"]:8.1f} rps  '
+                f'p50 {latency["p50"]:8.2f}  p95 {latency["p95"]:8.2f}  '
+                f'p99 {latency["p99"]:8.2f} мс  '
+                f'SQL {queries["mean"] if queries else "-"}  '
+                f'ошибок {result["errors"]}'
+            )
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(
+                    {'meta': self.get_meta(options), 'results': results},
+                    file, ensure_ascii=False, indent=2
+                )
+        if options['compare']:
+            self.compare(results, options['compare'])
@@ -0,0 +1,186 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models import Exists, OuterRef
+from django.db.models.query import RawQuerySet
+
+from recipes.models import Ingredient, Recipe, ShoppingListItem, Tag
+from users.models import Follow, User
+
+from .seed_benchmark import PREFIX
+
+PAGE_SIZE = 6
+RECIPES_LIMIT = 3
+INGREDIENT_SEARCH_LIMIT = 50
+
+SEQ_SCAN = {
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+    'sqlite': re.compile(r'\bSCAN (?:TABLE )?(\w+)'),
+}
+
+
+def get_hot_queries(user, author, tag_ids, prefix, database):
+    """Запросы основных эндпоинтов в том виде, как их строит API."""
+    following = User.objects.using(database).filter(
+        following__user=user
+    ).order_by('id')
+    return {
+        'recipe-list': Recipe.objects.all()[:PAGE_SIZE],
+        'recipe-list-author': Recipe.objects.filter(
+            author=author
+        )[:PAGE_SIZE],
+        'recipe-list-tags': Recipe.objects.filter(Exists(
+            Recipe.tags.through.objects.filter(
+                recipe=OuterRef('pk'), tag_id__in=tag_ids
+            )
+        ))[:PAGE_SIZE],
+        'recipe-list-favorited': Recipe.objects.filter(
+            favorite_recipes__user=user
+        )[:PAGE_SIZE],
+        'recipe-list-in-cart': Recipe.objects.filter(
+            cart_recipes__user=user
+        )[:PAGE_SIZE],
+        'recipe-flags': Recipe.objects.with_favorited_and_in_cart_status(
+            user
+        )[:PAGE_SIZE],
+        'recipe-search': Recipe.objects.search(prefix)[:PAGE_SIZE],
+        'subscriptions': following[:PAGE_SIZE],
+        'subscriptions-recipes': Recipe.objects.latest_for_authors(
+            list(following.values_list('id', flat=True)[:PAGE_SIZE]),
+            RECIPES_LIMIT
+        ),
+        'followers': Follow.objects.filter(following=author),
+        'is-subscribed': Follow.objects.filter(
+            user=user, following=author
+        ),
+        'ingredient-search': Ingredient.objects.filter(
+            name__istartswith=prefix
+        )[:INGREDIENT_SEARCH_LIMIT],
+        'shopping-list': ShoppingListItem.objects.filter(
+            user=user
+        ).order_by('ingredient__name').values_list(
+            'ingredient__name', 'ingredient__measurement_unit', 'amount'
+        ),
+    }
+
+
+def explain(queryset, **options):
+    """План запроса; RawQuerySet выполняется через курсор."""
+    if not isinstance(queryset, RawQuerySet):
+        return queryset.explain(**options)
+    connection = connections[queryset.db]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'{connection.ops.explain_query_prefix(**options)} '
+            f'{queryset.raw_query}',
+            queryset.params
+        )
+        return '\n'.join(
+            ' '.join(str(value) for value in row)
+            for row in cursor.fetchall()
+        )
+
+
+def find_seq_scans(connection, plan, queryset):
+    """
+    Таблицы, читаемые целиком. Промежуточные результаты подзапросов не
+    учитываются. В SQLite обход таблицы или индекса в порядке сортировки
+    до LIMIT (без временного B-дерева) выглядит в плане так же, как полное
+    чтение, и не считается им.
+    """
+    if (
+        connection.vendor == 'sqlite'
+        and 'TEMP B-TREE' not in plan
+        and getattr(queryset.query, 'high_mark', None) is not None
+    ):
+        return []
+    return sorted(
+        set(SEQ_SCAN[connection.vendor].findall(plan))
+        & set(connection.introspection.table_names())
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        'running EXPLAIN on the hot API queries and flagging sequential '
+        'scans; run on data from seed_benchmark after ANALYZE, the planner '
+        'legitimately scans small tables'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('queries', nargs='*',
+                            help='query names, default: all')
+        parser.add_argument('--user', type=int,
+                            help='id of the user the queries are built for, '
+                                 'default: the first seeded user')
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+        parser.add_argument('--analyze', action='store_true',
+                            help='EXPLAIN ANALYZE (PostgreSQL only)')
+        parser.add_argument('--fail-on-seq-scan', action='store_true',
+                            help='exit with an error if any query has a '
+                                 'sequential scan')
+
+    def get_user(self, options):
+        users = User.objects.using(options['database']).order_by('id')
+        if options['user'] is not None:
+            user = users.filter(pk=options['user']).first()
+        else:
+            user = (
+                users.filter(username__startswith=PREFIX).first()
+                or users.first()
+            )
+        if user is None:
+            raise CommandError('Пользователь не найден.')
+        return user
+
+    def handle(self, *args, **options):
+        database = options['database']
+        connection = connections[database]
+        vendor = connection.vendor
+        user = self.get_user(options)
+        recipe = Recipe.objects.using(database).only('author').first()
+        ingredient = Ingredient.objects.using(database).first()
+        if recipe is None or ingredient is None:
+            raise CommandError('Нет данных: сначала выполните seed_benchmark.')
+        queries = get_hot_queries(
+            user,
+            recipe.author_id,
+            list(Tag.objects.using(database).values_list('id', flat=True)[:2]),
+            ingredient.name[:2],
+            database
+        )
+        if unknown := set(options['queries']) - queries.keys():
+            raise CommandError(
+                f'Неизвестные запросы: {", ".join(sorted(unknown))}'
+            )
+        check = vendor in SEQ_SCAN
+        explain_options = {'analyze': True} if options['analyze'] else {}
+        flagged = {}
+        for name in options['queries'] or queries:
+            queryset = queries[name].using(database)
+            try:
+                plan = explain(queryset, **explain_options)
+            except ValueError as error:
+                raise CommandError(error)
+            if options['verbosity'] > 1:
+                self.stdout.write(f'\n{name}\n{plan}')
+            if not check:
+                self.stdout.write(f'{name}: план выведен без проверки')
+                continue
+            if tables := find_seq_scans(connection, plan, queryset):
+                flagged[name] = tables
+                self.stdout.write(self.style.WARNING(
+                    f'{name}: последовательное чтение {", ".join(tables)}'
+                ))
+            else:
+                self.stdout.write(f'{name}: OK')
+        if not check:
+            self.stdout.write(
+                f'Поиск последовательного чтения для {vendor} '
+                'не поддерживается.'
+            )
+        elif flagged and options['fail_on_seq_scan']:
+            raise CommandError(
+                f'Последовательное чтение в запросах: {", ".join(flagged)}'
+            )
@@ -0,0 +1,66 @@
+import posixpath
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from recipes.models import ImageBlob, Recipe
+from recipes.services import BATCH_SIZE, recount_image_references
+
+
+class Command(BaseCommand):
+    help = 'deleting recipe images without references from MEDIA_ROOT'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace', default=60, type=int,
+                            help='keep files modified in the last N minutes')
+        parser.add_argument('--recount', action='store_true',
+                            help='recount references from recipes first')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='only report files to delete')
+
+    def walk(self, storage, path):
+        """Все файлы каталога хранилища, включая вложенные."""
+        try:
+            directories, files = storage.listdir(path)
+        except FileNotFoundError:
+            return
+        for file in files:
+            yield posixpath.join(path, file)
+        for directory in directories:
+            yield from self.walk(storage, posixpath.join(path, directory))
+
+    def handle(self, *args, **options):
+        if options['recount']:
+            recount_image_references()
+        field = Recipe._meta.get_field('image')
+        storage = field.storage
+        referenced = set(
+            ImageBlob.objects.filter(
+                references__gt=0
+            ).values_list('name', flat=True)
+        )
+        cutoff = timezone.now() - timedelta(minutes=options['grace'])
+        seen, deleted, size = set(), [], 0
+        for name in self.walk(storage, field.upload_to.rstrip('/')):
+            seen.add(name)
+            if name in referenced or storage.get_modified_time(name) > cutoff:
+                continue
+            size += storage.size(name)
+            deleted.append(name)
+            if not options['dry_run']:
+                storage.delete(name)
+        if not options['dry_run']:
+            unreferenced = ImageBlob.objects.filter(references=0)
+            kept = seen.difference(deleted)
+            stale = [
+                name for name in unreferenced.values_list('name', flat=True)
+                if name not in kept
+            ]
+            for start in range(0, len(stale), BATCH_SIZE):
+                unreferenced.filter(
+                    name__in=stale[start:start + BATCH_SIZE]
+                ).delete()
+        self.stdout.write(
+            f'Удалено файлов: {len(deleted)}, освобождено: {size} байт'
+        )
@@ -1,36 +1,250 @@
+import csv
 import json
 import os
+import re
+import time
+from collections import defaultdict
+from itertools import islice
+from tempfile import SpooledTemporaryFile
 
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
-from django.db.utils import IntegrityError
+from django.db import connection, transaction
 
-from recipes.models import Ingredient
+from recipes.cache import catalogue_cache, recipe_cache
+from recipes.indexes import ingredient_index
+from recipes.models import CatalogueVersion, Ingredient
+from recipes.services import bump_catalogue_version
 
 DATA_ROOT = os.path.join(settings.BASE_DIR, 'data')
+CHUNK_SIZE = 64 * 1024
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+SEPARATORS = re.compile(r'[\s,]*')
+
+
+def get_values(item, line):
+    """Название и единица измерения из объекта JSON."""
+    try:
+        name, measurement_unit = item['name'], item['measurement_unit']
+    except (KeyError, TypeError):
+        name = measurement_unit = None
+    if not isinstance(name, str) or not isinstance(measurement_unit, str):
+        raise CommandError(
+            f'строка {line}: ожидался объект с полями name и '
+            'measurement_unit.'
+        )
+    return name, measurement_unit
+
+
+def iter_json_array(file):
+    """
+    Потоковое чтение JSON-массива объектов: файл читается блоками,
+    объекты разбираются по одному через JSONDecoder.raw_decode.
+    """
+    decoder = json.JSONDecoder()
+    buffer, position, started = '', 0, False
+    line = 1
+    while True:
+        chunk = file.read(CHUNK_SIZE)
+        line += buffer.count('\n', 0, position)
+        buffer = buffer[position:] + chunk
+        position = 0
+        while True:
+            position = SEPARATORS.match(buffer, position).end()
+            if position == len(buffer):
+                break
+            if not started:
+                if buffer[position] != '[':
+                    raise CommandError('Ожидался JSON-массив.')
+                started = True
+                position += 1
+                continue
+            if buffer[position] == ']':
+                return
+            item_line = line + buffer.count('\n', 0, position)
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if not chunk:
+                    raise CommandError(
+                        f'строка {item_line}: некорректный JSON.'
+                    )
+                break
+            yield get_values(item, item_line)
+        if not chunk:
+            raise CommandError('Некорректный JSON.')
+
+
+def iter_csv(file):
+    reader = csv.reader(file)
+    try:
+        for row in reader:
+            if not row:
+                continue
+            if len(row) < 2:
+                raise CommandError(
+                    f'строка {reader.line_num}: ожидались название и '
+                    'единица измерения.'
+                )
+            yield row[0], row[1]
+    except csv.Error as error:
+        raise CommandError(f'строка {reader.line_num}: {error}')
+
+
+READERS = {
+    '.json': iter_json_array,
+    '.csv': iter_csv,
+}
 
 
 class Command(BaseCommand):
-    help = 'loading ingredients from data in json'
+    help = 'loading ingredients from data in json or csv'
 
     def add_arguments(self, parser):
-        parser.add_argument('filename', default='ingredients.json', nargs='?',
-                            type=str)
+        parser.add_argument('filenames', default=['ingredients.json'],
+                            nargs='*', type=str)
+        parser.add_argument('--update', action='store_true',
+                            help='update measurement_unit of existing names')
+        parser.add_argument('--batch-size', default=500, type=int)
+        parser.add_argument('--no-copy', action='store_true',
+                            help='do not use COPY on PostgreSQL')
+
+    def read_rows(self, filenames):
+        for filename in filenames:
+            path = os.path.join(DATA_ROOT, filename)
+            reader = READERS.get(os.path.splitext(filename)[1].lower())
+            if reader is None:
+                raise CommandError(f'Неизвестный формат файла {filename}')
+            try:
+                with open(path, 'r', encoding='utf-8') as file:
+                    for name, measurement_unit in reader(file):
+                        yield name.strip(), measurement_unit.strip()
+            except FileNotFoundError:
+                raise CommandError('Файл отсутствует в директории data')
+            except CommandError as error:
+                raise CommandError(f'{filename}: {error}')
+
+    def load_batch(self, batch, update):
+        """Загрузка пачки {название: единица}; возвращает число обновленных."""
+        existing = {
+            ingredient.name: ingredient
+            for ingredient in Ingredient.objects.filter(
+                name__in=batch
+            ).only('id', 'name', 'measurement_unit')
+        }
+        Ingredient.objects.bulk_create(
+            (
+                Ingredient(name=name, measurement_unit=measurement_unit)
+                for name, measurement_unit in batch.items()
+                if name not in existing
+            ),
+            ignore_conflicts=True
+        )
+        updated = 0
+        if update:
+            changed = defaultdict(list)
+            for name, ingredient in existing.items():
+                if ingredient.measurement_unit != batch[name]:
+                    changed[batch[name]].append(ingredient.pk)
+            for measurement_unit, pks in changed.items():
+                updated += Ingredient.objects.filter(pk__in=pks).update(
+                    measurement_unit=measurement_unit
+                )
+        return updated
+
+    def load_orm(self, rows, update, batch_size):
+        """
+        Загрузка пачками через ORM. Из повторяющихся названий берется
+        первое. Добавленные считаются по числу строк справочника до и после
+        загрузки: bulk_create с ignore_conflicts возвращает и пропущенные.
+        """
+        total = updated = 0
+        before = Ingredient.objects.count()
+        seen = set()
+        rows = iter(rows)
+        while chunk := list(islice(rows, batch_size)):
+            total += len(chunk)
+            batch = {}
+            for name, measurement_unit in chunk:
+                if name not in seen:
+                    seen.add(name)
+                    batch[name] = measurement_unit
+            updated += self.load_batch(batch, update)
+        return total, Ingredient.objects.count() - before, updated
+
+    def load_copy(self, rows, update):
+        """
+        Загрузка через COPY во временную таблицу и перенос в справочник
+        одним INSERT ... ON CONFLICT (PostgreSQL). Из повторяющихся
+        названий, как и в load_orm, берется первое по порядку строк.
+        """
+        table = connection.ops.quote_name(Ingredient._meta.db_table)
+        total = 0
+        with SpooledTemporaryFile(
+            max_size=SPOOL_MAX_SIZE, mode='w+', encoding='utf-8', newline=''
+        ) as buffer:
+            writer = csv.writer(buffer)
+            for row in rows:
+                writer.writerow(row)
+                total += 1
+            buffer.seek(0)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'CREATE TEMPORARY TABLE ingredient_import '
+                    '(line serial, name varchar(200), '
+                    'measurement_unit varchar(200)) ON COMMIT DROP'
+                )
+                cursor.cursor.copy_expert(
+                    'COPY ingredient_import (name, measurement_unit) '
+                    'FROM STDIN WITH (FORMAT csv)',
+                    buffer
+                )
+                cursor.execute(
+                    'CREATE TEMPORARY VIEW ingredient_import_unique AS '
+                    'SELECT DISTINCT ON (name) name, measurement_unit '
+                    'FROM ingredient_import ORDER BY name, line'
+                )
+                updated = 0
+                if update:
+                    cursor.execute(
+                        f'UPDATE {table} AS ingredient '
+                        'SET measurement_unit = source.measurement_unit '
+                        'FROM ingredient_import_unique AS source '
+                        'WHERE ingredient.name = source.name '
+                        'AND ingredient.measurement_unit '
+                        '<> source.measurement_unit'
+                    )
+                    updated = cursor.rowcount
+                cursor.execute(
+                    f'INSERT INTO {table} (name, measurement_unit) '
+                    'SELECT name, measurement_unit '
+                    'FROM ingredient_import_unique '
+                    'ON CONFLICT (name) DO NOTHING'
+                )
+                inserted = cursor.rowcount
+                cursor.execute('DROP VIEW ingredient_import_unique')
+        return total, inserted, updated
 
     def handle(self, *args, **options):
-        try:
-            with open(os.path.join(DATA_ROOT, options['filename']), 'r',
-                      encoding='utf-8') as f:
-                data = json.load(f)
-                for ingredient in data:
-                    try:
-                        Ingredient.objects.create(name=ingredient["name"],
-                                                  measurement_unit=ingredient[
-                                                      "measurement_unit"])
-                    except IntegrityError:
-                        print(f'Ингридиет {ingredient["name"]} '
-                              f'{ingredient["measurement_unit"]} '
-                              f'уже есть в базе')
-
-        except FileNotFoundError:
-            raise CommandError('Файл отсутствует в директории data')
+        started = time.perf_counter()
+        rows = self.read_rows(options['filenames'])
+        with transaction.atomic():
+            if connection.vendor == 'postgresql' and not options['no_copy']:
+                total, inserted, updated = self.load_copy(
+                    rows, options['update']
+                )
+            else:
+                total, inserted, updated = self.load_orm(
+                    rows, options['update'], options['batch_size']
+                )
+            if inserted or updated:
+                bump_catalogue_version(CatalogueVersion.INGREDIENT)
+        ingredient_index.invalidate()
+        catalogue_cache.invalidate()
+        recipe_cache.invalidate()
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано строк: {total}, добавлено: {inserted}, '
+            f'обновлено: {updated}, пропущено: '
+            f'{total - inserted - updated} '
+            f'за {time.perf_counter() - started:.2f} с'
+        ))
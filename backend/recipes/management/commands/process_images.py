@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from recipes.images import process_recipe_image
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'processing recipe images without renditions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='reprocess images of all recipes')
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if not options['all']:
+            recipes = recipes.filter(image_thumbnail='')
+        count = 0
+        for recipe_id in recipes.values_list('id', flat=True).iterator():
+            process_recipe_image(recipe_id)
+            count += 1
+        self.stdout.write(f'Обработано изображений: {count}')
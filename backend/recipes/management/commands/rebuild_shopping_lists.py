@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from recipes.services import rebuild_shopping_lists
+
+
+class Command(BaseCommand):
+    help = 'rebuilding precomputed shopping lists from carts'
+
+    def handle(self, *args, **options):
+        count = rebuild_shopping_lists()
+        self.stdout.write(f'Позиций в списках покупок: {count}')
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from recipes.services import recount_counters
+
+
+class Command(BaseCommand):
+    help = 'recounting favorites, cart and recipes counters'
+
+    def handle(self, *args, **options):
+        recipes, users = recount_counters()
+        self.stdout.write(
+            f'Пересчитано рецептов: {recipes}, пользователей: {users}'
+        )
@@ -0,0 +1,210 @@
+import random
+import time
+from io import BytesIO
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from PIL import Image
+
+from recipes.cache import catalogue_cache, recipe_cache
+from recipes.indexes import ingredient_index, pantry_index, tag_index
+from recipes.models import (
+    Cart, CatalogueVersion, Favorite, Ingredient, Recipe, RecipeIngredient,
+    Tag
+)
+from recipes.services import (
+    BATCH_SIZE, bump_catalogue_version, rebuild_shopping_lists,
+    recount_counters, recount_image_references
+)
+from users.models import Follow, User
+
+PREFIX = 'bench'
+PASSWORD = 'bench-password'
+WORDS = (
+    'суп', 'салат', 'пирог', 'рагу', 'каша', 'запеканка', 'омлет', 'паста',
+    'плов', 'котлеты', 'блины', 'соус', 'десерт', 'хлеб', 'жаркое',
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'seeding a synthetic dataset for the benchmark command '
+        '(users and emails start with "bench")'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', default=200, type=int)
+        parser.add_argument('--recipes', default=5000, type=int)
+        parser.add_argument('--ingredients-per-recipe', default=8, type=int)
+        parser.add_argument('--catalogue', default=2000, type=int,
+                            help='minimal number of ingredients')
+        parser.add_argument('--tags', default=6, type=int,
+                            help='minimal number of tags')
+        parser.add_argument('--follows', default=20, type=int,
+                            help='subscriptions per user')
+        parser.add_argument('--favorites', default=50, type=int,
+                            help='favorite recipes per user')
+        parser.add_argument('--carts', default=10, type=int,
+                            help='recipes in the cart per user')
+        parser.add_argument('--seed', default=0, type=int)
+        parser.add_argument('--clear', action='store_true',
+                            help='delete previously seeded users first')
+
+    def ensure_catalogue(self, model, count, make):
+        """Дополняет справочник до count записей, возвращает все id."""
+        missing = count - model.objects.count()
+        if missing > 0:
+            model.objects.bulk_create(
+                (make(number) for number in range(missing)),
+                batch_size=BATCH_SIZE, ignore_conflicts=True
+            )
+        return list(model.objects.values_list('id', flat=True))
+
+    def save_image(self):
+        buffer = BytesIO()
+        Image.new('RGB', (480, 360), '#c0a080').save(buffer, 'JPEG')
+        return default_storage.save(
+            f'recipes/images/{PREFIX}.jpg', ContentFile(buffer.getvalue())
+        )
+
+    def create_users(self, count):
+        password = make_password(PASSWORD)
+        start = User.objects.filter(username__startswith=PREFIX).count()
+        User.objects.bulk_create(
+            (
+                User(
+                    username=f'{PREFIX}{number}',
+                    email=f'{PREFIX}{number}@example.com',
+                    first_name='Bench',
+                    last_name=str(number),
+                    password=password,
+                )
+                for number in range(start, start + count)
+            ),
+            batch_size=BATCH_SIZE
+        )
+        return list(User.objects.filter(
+            username__startswith=PREFIX
+        ).values_list('id', flat=True))
+
+    def create_recipes(self, rng, options, user_ids, ingredient_ids,
+                       tag_ids):
+        image = self.save_image()
+        marker = self.marker = f'{PREFIX}-{Recipe.objects.count()}'
+        Recipe.objects.bulk_create(
+            (
+                Recipe(
+                    author_id=rng.choice(user_ids),
+                    name=f'{rng.choice(WORDS).capitalize()} {number}',
+                    text=f'{marker} ' + ' '.join(rng.choices(WORDS, k=30)),
+                    cooking_time=rng.randint(1, 180),
+                    image=image,
+                    image_thumbnail=image,
+                    image_detail=image,
+                )
+                for number in range(options['recipes'])
+            ),
+            batch_size=BATCH_SIZE
+        )
+        recipe_ids = list(Recipe.objects.filter(
+            text__startswith=f'{marker} '
+        ).values_list('id', flat=True))
+        size = min(options['ingredients_per_recipe'], len(ingredient_ids))
+        RecipeIngredient.objects.bulk_create(
+            (
+                RecipeIngredient(
+                    recipe_id=recipe_id,
+                    ingredient_id=ingredient_id,
+                    amount=rng.randint(1, 500)
+                )
+                for recipe_id in recipe_ids
+                for ingredient_id in rng.sample(ingredient_ids, size)
+            ),
+            batch_size=BATCH_SIZE
+        )
+        Recipe.tags.through.objects.bulk_create(
+            (
+                Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+                for recipe_id in recipe_ids
+                for tag_id in rng.sample(
+                    tag_ids, rng.randint(1, min(3, len(tag_ids)))
+                )
+            ),
+            batch_size=BATCH_SIZE
+        )
+        return recipe_ids
+
+    def create_fan_out(self, model, rng, user_ids, targets, per_user, field):
+        """Связи пользователь -> per_user случайных объектов targets."""
+        model.objects.bulk_create(
+            (
+                model(user_id=user_id, **{f'{field}_id': target})
+                for user_id in user_ids
+                for target in rng.sample(
+                    targets, min(per_user, len(targets))
+                )
+                if target != user_id or field != 'following'
+            ),
+            batch_size=BATCH_SIZE, ignore_conflicts=True
+        )
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            if options['clear']:
+                deleted, _ = User.objects.filter(
+                    username__startswith=PREFIX
+                ).delete()
+                self.stdout.write(f'Удалено объектов: {deleted}')
+            ingredient_ids = self.ensure_catalogue(
+                Ingredient, options['catalogue'],
+                lambda number: Ingredient(
+                    name=f'{PREFIX} ингредиент {number}',
+                    measurement_unit=rng.choice(('г', 'мл', 'шт'))
+                )
+            )
+            tag_ids = self.ensure_catalogue(
+                Tag, options['tags'],
+                lambda number: Tag(
+                    name=f'{PREFIX} {number}',
+                    slug=f'{PREFIX}-{number}',
+                    color=f'#{rng.randrange(0x1000000):06X}'
+                )
+            )
+            user_ids = self.create_users(options['users'])
+            recipe_ids = self.create_recipes(
+                rng, options, user_ids, ingredient_ids, tag_ids
+            )
+            self.create_fan_out(
+                Follow, rng, user_ids, user_ids, options['follows'],
+                'following'
+            )
+            self.create_fan_out(
+                Favorite, rng, user_ids, recipe_ids, options['favorites'],
+                'recipe'
+            )
+            self.create_fan_out(
+                Cart, rng, user_ids, recipe_ids, options['carts'], 'recipe'
+            )
+            recount_counters()
+            rebuild_shopping_lists()
+            recount_image_references()
+            Recipe.objects.filter(
+                text__startswith=f'{self.marker} '
+            ).update_search_vector()
+            bump_catalogue_version(CatalogueVersion.INGREDIENT)
+            bump_catalogue_version(CatalogueVersion.TAG)
+        for index in (ingredient_index, tag_index, pantry_index):
+            index.invalidate()
+        catalogue_cache.invalidate()
+        recipe_cache.invalidate()
+        self.stdout.write(self.style.SUCCESS(
+            f'Пользователей: {len(user_ids)}, рецептов: {len(recipe_ids)}, '
+            f'ингредиентов в справочнике: {len(ingredient_ids)} '
+            f'за {time.perf_counter() - started:.2f} с. '
+            f'Пароль пользователей: {PASSWORD}'
+        ))
@@ -0,0 +1,40 @@
+# Generated by Django 3.2.3 on 2026-10-18 05:47
+
+from django.db import migrations, models
+
+
+def create_catalogue_versions(apps, schema_editor):
+    CatalogueVersion = apps.get_model('recipes', 'CatalogueVersion')
+    for name in ('tag', 'ingredient'):
+        CatalogueVersion.objects.get_or_create(name=name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0014_shoppinglistitem'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogueVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(choices=[('tag', 'Теги'), ('ingredient', 'Ингредиенты')], max_length=20, unique=True, verbose_name='Справочник')),
+                ('version', models.PositiveIntegerField(default=0, verbose_name='Версия')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата изменения')),
+            ],
+            options={
+                'verbose_name': 'версия справочника',
+                'verbose_name_plural': 'Версии справочников',
+            },
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, verbose_name='Дата изменения'),
+        ),
+        migrations.RunPython(
+            create_catalogue_versions, migrations.RunPython.noop
+        ),
+    ]
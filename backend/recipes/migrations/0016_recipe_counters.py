@@ -0,0 +1,51 @@
+# Generated by Django 3.2.3 on 2026-10-18 05:49
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def count_related(model, field):
+    return Coalesce(
+        models.Subquery(
+            model.objects.filter(
+                **{field: models.OuterRef('pk')}
+            ).order_by().values(field).annotate(
+                count=models.Count('pk')
+            ).values('count')
+        ),
+        0
+    )
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Favorite = apps.get_model('recipes', 'Favorite')
+    Cart = apps.get_model('recipes', 'Cart')
+    User = apps.get_model('users', 'User')
+    Recipe.objects.update(
+        favorites_count=count_related(Favorite, 'recipe'),
+        cart_count=count_related(Cart, 'recipe'),
+    )
+    User.objects.update(recipes_count=count_related(Recipe, 'author'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0015_catalogueversion_recipe_updated_at'),
+        ('users', '0011_user_recipes_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='cart_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В корзинах'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
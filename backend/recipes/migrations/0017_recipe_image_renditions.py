@@ -0,0 +1,23 @@
+# Generated by Django 3.2.3 on 2026-10-18 05:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0016_recipe_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_detail',
+            field=models.ImageField(blank=True, editable=False, upload_to='recipes/images/detail/', verbose_name='Картинка для страницы рецепта'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='image_thumbnail',
+            field=models.ImageField(blank=True, editable=False, upload_to='recipes/images/thumbnails/', verbose_name='Миниатюра для списков'),
+        ),
+    ]
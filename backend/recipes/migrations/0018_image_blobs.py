@@ -0,0 +1,52 @@
+# Generated by Django 3.2.3 on 2026-10-18 05:57
+
+from collections import Counter
+
+from django.db import migrations, models
+
+
+def fill_references(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    ImageBlob = apps.get_model('recipes', 'ImageBlob')
+    references = Counter(
+        name
+        for names in Recipe.objects.values_list(
+            'image', 'image_thumbnail', 'image_detail'
+        ).iterator()
+        for name in names if name
+    )
+    ImageBlob.objects.bulk_create(
+        (
+            ImageBlob(name=name, references=count)
+            for name, count in references.items()
+        ),
+        batch_size=500
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0017_recipe_image_renditions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='Файл')),
+                ('references', models.PositiveIntegerField(default=0, verbose_name='Ссылок')),
+            ],
+            options={
+                'verbose_name': 'файл изображения',
+                'verbose_name_plural': 'Файлы изображений',
+            },
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='image_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, verbose_name='Хеш загруженной картинки'),
+        ),
+        migrations.RunPython(fill_references, migrations.RunPython.noop),
+    ]
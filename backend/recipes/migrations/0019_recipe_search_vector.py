@@ -0,0 +1,56 @@
+# Generated by Django 3.2.3 on 2026-10-18 06:00
+
+import django.contrib.postgres.search
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations, models
+
+INDEX_NAME = 'recipes_recipe_search_vector_gin'
+
+
+def create_search_index(apps, schema_editor):
+    """
+    Заполнение вектора и GIN-индекс. GinIndex в Meta.indexes не
+    создается на SQLite, поэтому индекс добавляется только на PostgreSQL.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    Recipe = apps.get_model('recipes', 'Recipe')
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    ingredient_names = models.Subquery(
+        RecipeIngredient.objects.filter(
+            recipe=models.OuterRef('pk')
+        ).order_by().values('recipe').annotate(
+            names=StringAgg('ingredient__name', ' ')
+        ).values('names')
+    )
+    Recipe.objects.update(search_vector=(
+        SearchVector('name', weight='A', config='russian')
+        + SearchVector(ingredient_names, weight='B', config='russian')
+        + SearchVector('text', weight='C', config='russian')
+    ))
+    schema_editor.execute(
+        f'CREATE INDEX {INDEX_NAME} ON recipes_recipe '
+        'USING gin (search_vector)'
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS {INDEX_NAME}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0018_image_blobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 3.2.3 on 2026-10-18 06:28
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+INGREDIENT_INDEX_NAME = 'recipes_ingredient_name_upper_like'
+
+
+def create_ingredient_name_index(apps, schema_editor):
+    """
+    Индекс для поиска ингредиента по началу названия без учета регистра.
+    На PostgreSQL name__istartswith превращается в
+    UPPER(name::text) LIKE UPPER('...%'), что не использует уникальный
+    индекс name; класс операторов text_pattern_ops нужен для LIKE при
+    любой локали базы. Индексы по выражению с классом операторов Django 3.2
+    не описывает, поэтому индекс создается только на PostgreSQL.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        f'CREATE INDEX {INGREDIENT_INDEX_NAME} ON recipes_ingredient '
+        '(UPPER(name::text) text_pattern_ops)'
+    )
+
+
+def drop_ingredient_name_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS {INGREDIENT_INDEX_NAME}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0020_favorite_cart_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', '-id'], name='recipe_author_id_desc_idx'),
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='author',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='recipes', to=settings.AUTH_USER_MODEL, verbose_name='Автор'),
+        ),
+        migrations.RunPython(
+            create_ingredient_name_index, drop_ingredient_name_index
+        ),
+    ]
@@ -1,18 +1,177 @@
+from collections import defaultdict
+
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector, SearchVectorField)
 from django.core.validators import (MaxValueValidator, MinValueValidator,
                                     RegexValidator)
-from django.db import models
+from django.db import connections, models
+from django.db.models.functions import RowNumber
 
-from users.models import User
+from foodgram.db.functions import Casefold
+from users.models import Follow, User
 
 MAX_LENGTH = 10
 MIN_VALUE = 1
 MAX_VALUE = 32000
+IMAGE_FIELDS = ('image', 'image_thumbnail', 'image_detail')
+SEARCH_CONFIG = 'russian'
+
+
+def get_search_vector():
+    """
+    Поисковый вектор рецепта: название (вес A), названия ингредиентов (B)
+    и описание (C).
+    """
+    ingredient_names = models.Subquery(
+        RecipeIngredient.objects.filter(
+            recipe=models.OuterRef('pk')
+        ).order_by().values('recipe').annotate(
+            names=StringAgg('ingredient__name', ' ')
+        ).values('names')
+    )
+    return (
+        SearchVector('name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector(ingredient_names, weight='B', config=SEARCH_CONFIG)
+        + SearchVector('text', weight='C', config=SEARCH_CONFIG)
+    )
 
 
 class RecipeQuerySet(models.QuerySet):
     """QuerySet для модели рецептов."""
 
+    def with_related_data(self, user):
+        """
+        Подгружает теги, ингредиенты и автора с признаком подписки
+        фиксированным числом запросов независимо от размера страницы.
+        Для анонимного пользователя признак подписки всегда ложный.
+        Поисковый вектор для вывода не нужен и не загружается.
+        """
+        authors = User.objects.all()
+        if user.is_authenticated:
+            authors = authors.annotate(
+                is_subscribed=models.Exists(
+                    Follow.objects.filter(
+                        user=user,
+                        following=models.OuterRef('pk')
+                    )
+                )
+            )
+        else:
+            authors = authors.annotate(
+                is_subscribed=models.Value(
+                    False, output_field=models.BooleanField()
+                )
+            )
+        return self.defer('search_vector').prefetch_related(
+            'tags',
+            models.Prefetch(
+                'recipe_ingredient',
+                queryset=RecipeIngredient.objects.select_related(
+                    'ingredient'
+                )
+            ),
+            models.Prefetch('author', queryset=authors),
+        )
+
+    def latest_for_authors(self, authors, limit=None):
+        """
+        Запрос последних рецептов каждого из авторов.
+
+        При заданном лимите рецепты нумеруются оконной функцией ROW_NUMBER()
+        в разрезе автора, и отбираются первые limit из каждой группы
+        (возвращается RawQuerySet).
+        """
+        queryset = self.filter(author__in=authors)
+        if limit is None:
+            return queryset
+        ranked = queryset.order_by().annotate(
+            recipe_rank=models.Window(
+                expression=RowNumber(),
+                partition_by=models.F('author'),
+                order_by=models.F('id').desc(),
+            )
+        )
+        sql, params = ranked.query.sql_with_params()
+        return self.raw(
+            f'SELECT * FROM ({sql}) ranked '
+            'WHERE recipe_rank <= %s ORDER BY id DESC',
+            (*params, limit)
+        )
+
+    def latest_by_author(self, authors, limit=None):
+        """
+        Последние рецепты каждого из авторов одним запросом.
+        Возвращает словарь {id автора: [рецепты]}.
+        """
+        recipes = defaultdict(list)
+        for recipe in self.latest_for_authors(authors, limit):
+            recipes[recipe.author_id].append(recipe)
+        return recipes
+
+    def search(self, query):
+        """
+        Полнотекстовый поиск по названию, ингредиентам и описанию.
+
+        Рецепты сортируются по релевантности (аннотация rank). На
+        PostgreSQL используется сохраненный вектор search_vector и
+        GIN-индекс, на других СУБД - поиск подстроки без учета регистра
+        (в том числе кириллицы, Casefold) с теми же весами.
+        """
+        if connections[self.db].vendor == 'postgresql':
+            search_query = SearchQuery(
+                query, config=SEARCH_CONFIG, search_type='websearch'
+            )
+            queryset = self.filter(search_vector=search_query).annotate(
+                rank=SearchRank(models.F('search_vector'), search_query)
+            )
+        else:
+            query = query.casefold()
+            queryset = self.alias(
+                folded_name=Casefold('name'),
+                folded_text=Casefold('text'),
+                in_ingredients=models.Exists(
+                    RecipeIngredient.objects.alias(
+                        folded_name=Casefold('ingredient__name')
+                    ).filter(
+                        recipe=models.OuterRef('pk'),
+                        folded_name__contains=query
+                    )
+                )
+            ).filter(
+                models.Q(folded_name__contains=query)
+                | models.Q(in_ingredients=True)
+                | models.Q(folded_text__contains=query)
+            ).annotate(
+                rank=models.Case(
+                    models.When(folded_name__contains=query, then=1.0),
+                    models.When(in_ingredients=True, then=0.4),
+                    default=0.2,
+                    output_field=models.FloatField()
+                )
+            )
+        return queryset.order_by('-rank', '-id')
+
+    def update_search_vector(self):
+        """Пересчет поискового вектора рецептов (только PostgreSQL)."""
+        if connections[self.db].vendor != 'postgresql':
+            return 0
+        return self.update(search_vector=get_search_vector())
+
     def with_favorited_and_in_cart_status(self, user):
+        """
+        Признаки is_favorited и is_in_shopping_cart. Для анонимного
+        пользователя - константа False без подзапросов.
+        """
+        if not user.is_authenticated:
+            return self.annotate(
+                is_favorited=models.Value(
+                    False, output_field=models.BooleanField()
+                ),
+                is_in_shopping_cart=models.Value(
+                    False, output_field=models.BooleanField()
+                )
+            )
         return self.annotate(
             is_favorited=models.Exists(
                 Favorite.objects.filter(
@@ -88,6 +247,68 @@ class Ingredient(models.Model):
         return self.name
 
 
+class CatalogueVersion(models.Model):
+    """
+    Версия справочника (теги, ингредиенты).
+
+    Увеличивается при каждом изменении справочника и служит основой
+    для ETag/Last-Modified ответов API.
+    """
+
+    TAG = 'tag'
+    INGREDIENT = 'ingredient'
+    CATALOGUES = (
+        (TAG, 'Теги'),
+        (INGREDIENT, 'Ингредиенты'),
+    )
+
+    name = models.CharField(
+        'Справочник',
+        max_length=20,
+        unique=True,
+        choices=CATALOGUES,
+    )
+    version = models.PositiveIntegerField(
+        'Версия',
+        default=0,
+    )
+    updated_at = models.DateTimeField(
+        'Дата изменения',
+        auto_now=True,
+    )
+
+    class Meta:
+        verbose_name = 'версия справочника'
+        verbose_name_plural = 'Версии справочников'
+
+    def __str__(self):
+        return f'{self.name} v{self.version}'
+
+
+class ImageBlob(models.Model):
+    """
+    Файл изображения в хранилище и число ссылок на него из рецептов
+    (оригиналы и уменьшенные копии). Файлы без ссылок удаляет gc_images.
+    """
+
+    name = models.CharField(
+        'Файл',
+        max_length=255,
+        unique=True,
+    )
+    references = models.PositiveIntegerField(
+        'Ссылок',
+        default=0,
+    )
+
+    class Meta:
+        verbose_name = 'файл изображения'
+        verbose_name_plural = 'Файлы изображений'
+
+    def __str__(self):
+        return self.name
+
+
 class Recipe(models.Model):
     """Модель рецепта (мэни ту мэни: ингредиенты и тэги)."""
 
@@ -111,6 +332,24 @@ class Recipe(models.Model):
         'Картинка рецепта',
         upload_to='recipes/images/',
     )
+    image_thumbnail = models.ImageField(
+        'Миниатюра для списков',
+        upload_to='recipes/images/thumbnails/',
+        blank=True,
+        editable=False,
+    )
+    image_detail = models.ImageField(
+        'Картинка для страницы рецепта',
+        upload_to='recipes/images/detail/',
+        blank=True,
+        editable=False,
+    )
+    image_hash = models.CharField(
+        'Хеш загруженной картинки',
+        max_length=64,
+        blank=True,
+        editable=False,
+    )
     cooking_time = models.PositiveSmallIntegerField(
         validators=(
             MinValueValidator(
@@ -132,6 +371,26 @@ class Recipe(models.Model):
         on_delete=models.CASCADE,
         related_name='recipes',
         verbose_name='Автор',
+        db_index=False
+    )
+    updated_at = models.DateTimeField(
+        'Дата изменения',
+        auto_now=True,
+    )
+    favorites_count = models.PositiveIntegerField(
+        'В избранном',
+        default=0,
+        editable=False,
+    )
+    cart_count = models.PositiveIntegerField(
+        'В корзинах',
+        default=0,
+        editable=False,
+    )
+    search_vector = SearchVectorField(
+        'Поисковый вектор',
+        null=True,
+        editable=False,
     )
     objects = models.Manager.from_queryset(
         RecipeQuerySet
@@ -141,6 +400,10 @@ class Recipe(models.Model):
         ordering = ('-id',)
         verbose_name = 'рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = (models.Index(
+            fields=('author', '-id'),
+            name='recipe_author_id_desc_idx'
+        ),)
 
     def __str__(self):
         return self.name
@@ -153,13 +416,15 @@ class Favorite(models.Model):
         User,
         on_delete=models.CASCADE,
         related_name='favorite_recipe',
-        verbose_name='Избранный'
+        verbose_name='Избранный',
+        db_index=False
     )
     recipe = models.ForeignKey(
         Recipe,
         on_delete=models.CASCADE,
         related_name='favorite_recipes',
-        verbose_name='Избранный рецепт'
+        verbose_name='Избранный рецепт',
+        db_index=False
     )
 
     class Meta:
@@ -169,6 +434,10 @@ class Favorite(models.Model):
             fields=('user', 'recipe'),
             name='unique_favorites'
         ),)
+        indexes = (models.Index(
+            fields=('recipe', 'user'),
+            name='favorite_recipe_user_idx'
+        ),)
 
 
 class RecipeIngredient(models.Model):
@@ -210,13 +479,15 @@ class Cart(models.Model):
         User,
         on_delete=models.CASCADE,
         related_name='cart_recipe',
-        verbose_name='Владелец корзины'
+        verbose_name='Владелец корзины',
+        db_index=False
     )
     recipe = models.ForeignKey(
         Recipe,
         on_delete=models.CASCADE,
         related_name='cart_recipes',
-        verbose_name='Рецепт в корзине'
+        verbose_name='Рецепт в корзине',
+        db_index=False
     )
 
     class Meta:
@@ -226,3 +497,38 @@ class Cart(models.Model):
             fields=('user', 'recipe'),
             name='unique_cart'
         ),)
+        indexes = (models.Index(
+            fields=('recipe', 'user'),
+            name='cart_recipe_user_idx'
+        ),)
+
+
+class ShoppingListItem(models.Model):
+    """
+    Предрассчитанный список покупок: суммарное количество ингредиента
+    по всем рецептам в корзине пользователя.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Владелец списка'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_items',
+        verbose_name='Ингредиент'
+    )
+    amount = models.PositiveIntegerField(
+        'Количество',
+    )
+
+    class Meta:
+        verbose_name = 'позиция списка покупок'
+        verbose_name_plural = 'Список покупок'
+        constraints = (models.UniqueConstraint(
+            fields=('user', 'ingredient'),
+            name='unique_shopping_list_item'
+        ),)
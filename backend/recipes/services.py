@@ -0,0 +1,284 @@
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from users.models import User
+from .indexes import pantry_index
+from .models import (
+    IMAGE_FIELDS, Cart, CatalogueVersion, Favorite, ImageBlob, Recipe,
+    RecipeIngredient, ShoppingListItem
+)
+
+BATCH_SIZE = 500
+
+deleting_recipe_ids = ContextVar('deleting_recipe_ids', default=frozenset())
+
+
+def change_counter(model, pk, field, delta):
+    """Атомарное изменение счетчика через F()."""
+    model.objects.filter(pk=pk).update(**{field: F(field) + delta})
+
+
+def count_related(model, field):
+    """Подзапрос с количеством строк model, ссылающихся на внешнюю запись."""
+    return Coalesce(
+        Subquery(
+            model.objects.filter(
+                **{field: OuterRef('pk')}
+            ).order_by().values(field).annotate(
+                count=Count('pk')
+            ).values('count')
+        ),
+        0
+    )
+
+
+@transaction.atomic
+def recount_counters():
+    """
+    Пересчет денормализованных счетчиков по фактическим данным для
+    исправления расхождений; обычно их ведут сигналы.
+    """
+    recipes = Recipe.objects.update(
+        favorites_count=count_related(Favorite, 'recipe'),
+        cart_count=count_related(Cart, 'recipe'),
+    )
+    users = User.objects.update(
+        recipes_count=count_related(Recipe, 'author')
+    )
+    return recipes, users
+
+
+def get_catalogue_versions():
+    """Версии справочников: {название: (версия, дата изменения)}."""
+    return {
+        name: (version, updated_at)
+        for name, version, updated_at in CatalogueVersion.objects.values_list(
+            'name', 'version', 'updated_at'
+        )
+    }
+
+
+def bump_catalogue_version(name):
+    """Отмечает изменение справочника."""
+    if not CatalogueVersion.objects.filter(name=name).update(
+        version=F('version') + 1,
+        updated_at=timezone.now()
+    ):
+        CatalogueVersion.objects.create(name=name, version=1)
+
+
+def get_recipe_amounts(recipe):
+    """Количества ингредиентов рецепта: {id ингредиента: количество}."""
+    return dict(
+        RecipeIngredient.objects.filter(
+            recipe=recipe
+        ).values_list('ingredient_id', 'amount')
+    )
+
+
+def get_amounts_difference(old_amounts, new_amounts):
+    """Изменение количеств ингредиентов между двумя версиями рецепта."""
+    return {
+        ingredient_id: (
+            new_amounts.get(ingredient_id, 0)
+            - old_amounts.get(ingredient_id, 0)
+        )
+        for ingredient_id in old_amounts.keys() | new_amounts.keys()
+    }
+
+
+@transaction.atomic
+def update_shopping_lists(user_ids, deltas):
+    """
+    Применяет изменения количеств ингредиентов к спискам покупок
+    пользователей. Позиции с нулевым остатком удаляются.
+
+    Строки пользователей блокируются в порядке id: параллельные изменения
+    списка одного пользователя выполняются по очереди, и одна позиция не
+    создается дважды. FOR NO KEY UPDATE не конфликтует с блокировками
+    внешних ключей при добавлении корзин.
+    """
+    deltas = {
+        ingredient_id: delta
+        for ingredient_id, delta in deltas.items() if delta
+    }
+    if not deltas:
+        return
+    user_ids = list(User.objects.select_for_update(no_key=True).filter(
+        pk__in=user_ids
+    ).order_by('pk').values_list('pk', flat=True))
+    if not user_ids:
+        return
+    existing = {
+        (item.user_id, item.ingredient_id): item
+        for item in ShoppingListItem.objects.filter(
+            user_id__in=user_ids,
+            ingredient_id__in=deltas
+        )
+    }
+    to_create, to_update, to_delete = [], [], []
+    for user_id in user_ids:
+        for ingredient_id, delta in deltas.items():
+            item = existing.get((user_id, ingredient_id))
+            if item is None:
+                if delta > 0:
+                    to_create.append(ShoppingListItem(
+                        user_id=user_id,
+                        ingredient_id=ingredient_id,
+                        amount=delta
+                    ))
+                continue
+            item.amount += delta
+            if item.amount > 0:
+                to_update.append(item)
+            else:
+                to_delete.append(item.pk)
+    ShoppingListItem.objects.bulk_create(to_create)
+    ShoppingListItem.objects.bulk_update(to_update, ('amount',))
+    ShoppingListItem.objects.filter(pk__in=to_delete).delete()
+
+
+def add_recipe_to_shopping_list(user_id, recipe_id):
+    """Учет рецепта, добавленного в корзину."""
+    update_shopping_lists((user_id,), get_recipe_amounts(recipe_id))
+
+
+def remove_recipe_from_shopping_list(user_id, amounts):
+    """Учет рецепта с составом amounts, удаленного из корзины."""
+    update_shopping_lists(
+        (user_id,), get_amounts_difference(amounts, {})
+    )
+
+
+def change_recipe_in_shopping_lists(recipe, old_amounts, new_amounts):
+    """Учет изменения ингредиентов рецепта у всех, у кого он в корзине."""
+    update_shopping_lists(
+        Cart.objects.filter(recipe=recipe).values_list('user_id', flat=True),
+        get_amounts_difference(old_amounts, new_amounts)
+    )
+
+
+def update_recipe_indexes(recipe_id, ingredient_ids):
+    """
+    Обновление поискового вектора и индекса подбора рецептов после
+    изменения состава рецепта.
+    """
+    Recipe.objects.filter(pk=recipe_id).update_search_vector()
+    transaction.on_commit(
+        lambda: pantry_index.update_recipe(recipe_id, ingredient_ids)
+    )
+
+
+def is_recipe_deleting(recipe_id):
+    return recipe_id in deleting_recipe_ids.get()
+
+
+@contextmanager
+def deleting_recipe(recipe_id):
+    """
+    Удаление рецепта внутри блока: сигналы удаления его корзин и
+    избранного не обновляют списки покупок и счетчики рецепта, изменения
+    учитываются одним пакетом (delete_recipe).
+    """
+    token = deleting_recipe_ids.set(deleting_recipe_ids.get() | {recipe_id})
+    try:
+        yield
+    finally:
+        deleting_recipe_ids.reset(token)
+
+
+@transaction.atomic
+def delete_recipe(recipe):
+    """
+    Удаление рецепта. Списки покупок всех, у кого рецепт в корзине,
+    обновляются одним пакетом до удаления; счетчик рецептов автора
+    уменьшается сигналом удаления рецепта.
+    """
+    change_recipe_in_shopping_lists(recipe, get_recipe_amounts(recipe), {})
+    with deleting_recipe(recipe.pk):
+        recipe.delete()
+
+
+@transaction.atomic
+def rebuild_shopping_lists(user_ids=None):
+    """Полный пересчет списков покупок по содержимому корзин."""
+    items = ShoppingListItem.objects.all()
+    if user_ids is None:
+        carted = {'recipe__cart_recipes__isnull': False}
+    else:
+        carted = {'recipe__cart_recipes__user__in': user_ids}
+        items = items.filter(user__in=user_ids)
+    totals = RecipeIngredient.objects.filter(**carted).values_list(
+        'recipe__cart_recipes__user', 'ingredient'
+    ).annotate(total=Sum('amount')).order_by()
+    items.delete()
+    return len(ShoppingListItem.objects.bulk_create(
+        ShoppingListItem(
+            user_id=user_id,
+            ingredient_id=ingredient_id,
+            amount=total
+        )
+        for user_id, ingredient_id, total in totals
+    ))
+
+
+def get_image_names(recipe):
+    """Имена файлов изображений рецепта (оригинал и уменьшенные копии)."""
+    return [getattr(recipe, field).name for field in IMAGE_FIELDS]
+
+
+def change_image_references(added=(), removed=()):
+    """
+    Изменение счетчиков ссылок на файлы изображений: +1 за каждое имя
+    из added, -1 за каждое из removed. Пустые имена пропускаются.
+    """
+    delta = Counter(name for name in added if name)
+    delta.subtract(name for name in removed if name)
+    names_by_delta = defaultdict(list)
+    for name, count in delta.items():
+        if count:
+            names_by_delta[count].append(name)
+    if not names_by_delta:
+        return
+    ImageBlob.objects.bulk_create(
+        (
+            ImageBlob(name=name)
+            for name, count in delta.items() if count > 0
+        ),
+        ignore_conflicts=True
+    )
+    for count, names in names_by_delta.items():
+        ImageBlob.objects.filter(name__in=names).update(
+            references=Greatest(F('references') + count, 0)
+        )
+
+
+@transaction.atomic
+def recount_image_references():
+    """Пересчет ссылок на файлы изображений по фактическим данным."""
+    references = Counter(
+        name
+        for names in Recipe.objects.values_list(*IMAGE_FIELDS).iterator()
+        for name in names if name
+    )
+    ImageBlob.objects.update(references=0)
+    names_by_count = defaultdict(list)
+    for name, count in references.items():
+        names_by_count[count].append(name)
+    ImageBlob.objects.bulk_create(
+        (ImageBlob(name=name) for name in references),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True
+    )
+    for count, names in names_by_count.items():
+        for start in range(0, len(names), BATCH_SIZE):
+            ImageBlob.objects.filter(
+                name__in=names[start:start + BATCH_SIZE]
+            ).update(references=count)
+    return len(references)
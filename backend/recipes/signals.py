@@ -0,0 +1,191 @@
+from django.db import transaction
+from django.db.models.signals import (
+    post_delete, post_save, pre_delete, pre_save
+)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from rest_framework.authtoken.models import Token
+
+from users.models import Follow, User
+from .cache import (
+    catalogue_cache, invalidate_token, invalidate_user_flags, recipe_cache
+)
+from .indexes import ingredient_index, pantry_index, tag_index
+from .models import (
+    IMAGE_FIELDS, Cart, CatalogueVersion, Favorite, Ingredient, Recipe, Tag
+)
+from .services import (
+    add_recipe_to_shopping_list, bump_catalogue_version, change_counter,
+    change_image_references, get_image_names, get_recipe_amounts,
+    is_recipe_deleting, remove_recipe_from_shopping_list
+)
+from .storage import file_digest
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def ingredient_changed(**kwargs):
+    catalogue_cache.invalidate()
+    transaction.on_commit(recipe_cache.invalidate)
+    ingredient_index.invalidate()
+    bump_catalogue_version(CatalogueVersion.INGREDIENT)
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_saved(instance, created, **kwargs):
+    if not created:
+        Recipe.objects.filter(
+            recipe_ingredient__ingredient=instance
+        ).update_search_vector()
+
+
+@receiver(post_delete, sender=Ingredient)
+def ingredient_deleted(**kwargs):
+    pantry_index.invalidate()
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def tag_changed(**kwargs):
+    catalogue_cache.invalidate()
+    transaction.on_commit(recipe_cache.invalidate)
+    tag_index.invalidate()
+    bump_catalogue_version(CatalogueVersion.TAG)
+
+
+@receiver(pre_save, sender=Recipe)
+def recipe_saving(instance, **kwargs):
+    """
+    Запоминает прежних автора и файлы изображений рецепта (одним
+    запросом) и хеш новой загрузки, по которому повторная отправка той же
+    картинки не вызывает записи.
+    """
+    if instance.image and not instance.image._committed:
+        instance.image_hash = file_digest(instance.image)
+    author_id, *images = (None,) if instance._state.adding else (
+        Recipe.objects.filter(pk=instance.pk).values_list(
+            'author_id', *IMAGE_FIELDS
+        ).first() or (None,)
+    )
+    instance._previous_author_id = author_id
+    instance._previous_images = images
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_images_saved(instance, **kwargs):
+    change_image_references(
+        added=get_image_names(instance),
+        removed=instance.__dict__.pop('_previous_images', ())
+    )
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(instance, **kwargs):
+    change_image_references(removed=get_image_names(instance))
+    recipe_id = instance.pk
+    transaction.on_commit(lambda: pantry_index.remove_recipe(recipe_id))
+
+
+@receiver(post_save, sender=Recipe)
+def author_counter_changed(instance, **kwargs):
+    """
+    Счетчик рецептов автора: новый рецепт засчитывается автору, при
+    смене автора рецепт переходит к новому.
+    """
+    previous = instance.__dict__.pop('_previous_author_id', None)
+    if previous == instance.author_id:
+        return
+    if previous is not None:
+        change_counter(User, previous, 'recipes_count', -1)
+    change_counter(User, instance.author_id, 'recipes_count', 1)
+
+
+@receiver(post_delete, sender=Recipe)
+def author_counter_decreased(instance, **kwargs):
+    change_counter(User, instance.author_id, 'recipes_count', -1)
+
+
+COUNTERS = {Favorite: 'favorites_count', Cart: 'cart_count'}
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=Cart)
+def recipe_counter_increased(sender, instance, created, **kwargs):
+    """Счетчики рецепта: добавление в избранное или корзину."""
+    if created:
+        change_counter(Recipe, instance.recipe_id, COUNTERS[sender], 1)
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=Cart)
+def recipe_counter_decreased(sender, instance, **kwargs):
+    """Удаляемому рецепту (delete_recipe) счетчики уже не нужны."""
+    if not is_recipe_deleting(instance.recipe_id):
+        change_counter(Recipe, instance.recipe_id, COUNTERS[sender], -1)
+
+
+@receiver(post_save, sender=Cart)
+def cart_saved(instance, created, **kwargs):
+    """Рецепт в корзине: его ингредиенты добавляются в список покупок."""
+    if created:
+        add_recipe_to_shopping_list(instance.user_id, instance.recipe_id)
+
+
+@receiver(pre_delete, sender=Cart)
+def cart_deleting(instance, **kwargs):
+    """
+    Запоминает состав рецепта до удаления. Сигналы pre_delete приходят
+    до удаления любых строк, поэтому состав известен и при каскадном
+    удалении автора рецепта. При удалении самого рецепта (delete_recipe)
+    списки покупок уже обновлены одним пакетом.
+    """
+    if not is_recipe_deleting(instance.recipe_id):
+        instance._recipe_amounts = get_recipe_amounts(instance.recipe_id)
+
+
+@receiver(post_delete, sender=Cart)
+def cart_deleted(instance, **kwargs):
+    if is_recipe_deleting(instance.recipe_id):
+        return
+    remove_recipe_from_shopping_list(
+        instance.user_id, instance.__dict__.pop('_recipe_amounts', {})
+    )
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def recipe_changed(**kwargs):
+    transaction.on_commit(recipe_cache.invalidate)
+
+
+@receiver(post_save, sender=User)
+def user_saved(instance, created, update_fields, **kwargs):
+    """
+    Имя и email автора выводятся в рецептах: у его рецептов обновляется
+    дата изменения (валидаторы HTTP) и сбрасывается кэш рецептов. Данные
+    пользователя хранятся в кэше токенов. Новый пользователь еще нигде
+    не выводится, обновление last_login при входе эти данные не меняет.
+    """
+    if created or update_fields is not None and set(update_fields) <= {
+        'last_login'
+    }:
+        return
+    if instance.recipes.update(updated_at=timezone.now()):
+        transaction.on_commit(recipe_cache.invalidate)
+    if key := Token.objects.filter(user=instance).values_list(
+        'key', flat=True
+    ).first():
+        transaction.on_commit(lambda: invalidate_token(key))
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(instance, **kwargs):
+    """Выход и удаление пользователя (токен удаляется каскадно)."""
+    key = instance.key
+    transaction.on_commit(lambda: invalidate_token(key))
+
+
+@receiver((post_save, post_delete), sender=Favorite)
+@receiver((post_save, post_delete), sender=Cart)
+@receiver((post_save, post_delete), sender=Follow)
+def user_flags_changed(instance, **kwargs):
+    user_id = instance.user_id
+    transaction.on_commit(lambda: invalidate_user_flags(user_id))
@@ -0,0 +1,45 @@
+import hashlib
+import os
+import posixpath
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+def file_digest(content):
+    """SHA-256 содержимого файла; позиция чтения возвращается в начало."""
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Файловое хранилище с именами по содержимому.
+
+    Файл сохраняется в каталог upload_to под именем
+    <первые два символа хеша>/<sha256><расширение>. Если такой файл уже
+    есть, запись пропускается, а у файла обновляется время изменения,
+    чтобы сборщик мусора (gc_images) не удалил только что использованный
+    файл.
+    """
+
+    def get_content_name(self, name, digest):
+        directory, filename = posixpath.split(name)
+        extension = os.path.splitext(filename)[1].lower()
+        return posixpath.join(directory, digest[:2], digest + extension)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.get_content_name(name, file_digest(content))
+        if self.exists(name):
+            os.utime(self.path(name))
+            return name
+        return super().save(name, content, max_length)
@@ -31,6 +31,11 @@ class User(AbstractUser):
         'Фамилия',
         max_length=150,
     )
+    recipes_count = models.PositiveIntegerField(
+        'Количество рецептов',
+        default=0,
+        editable=False,
+    )
 
     REQUIRED_FIELDS = ('first_name', 'last_name', 'username')
     USERNAME_FIELD = 'email'
@@ -51,13 +56,15 @@ class Follow(models.Model):
         User,
         on_delete=models.CASCADE,
         verbose_name='Подписчики',
-        related_name='follower'
+        related_name='follower',
+        db_index=False
     )
     following = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
         verbose_name='Автор',
         related_name='following',
+        db_index=False
     )
 
     def clean(self):
@@ -71,5 +78,11 @@ class Follow(models.Model):
                 name='unique_following'
             ),
         ]
+        indexes = [
+            models.Index(
+                fields=['following', 'user'],
+                name='follow_following_user_idx'
+            ),
+        ]
         verbose_name = 'подписка'
         verbose_name_plural = 'Подписки'